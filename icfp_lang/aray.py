@@ -1,11 +1,16 @@
 #!/usr/bin/env python
 # %% imports
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import os
 import json
 import hashlib
+import functools
 import time
 import random
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
 from dataclasses import dataclass, field
 
 # %% file paths and constants
@@ -17,28 +22,33 @@ with open(auth_path, 'r') as file:
     auth = file.read()
 assert auth.startswith("Authorization: Bearer ")
 # convert to dict for requests
-auth = {"Authorization": auth.lstrip("Authorization: ").strip()}
+auth = {"Authorization": auth.removeprefix("Authorization: ").strip()}
 
-# Cache for requests and responses, as simple json files
+# Reuse one keep-alive connection for every request, retrying when the server is busy
+session = requests.Session()
+session.headers.update(auth)
+session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=4, max_retries=Retry(
+    total=3, backoff_factor=2, status_forcelist=[429, 502, 503], allowed_methods=['POST'])))
+
+# Cache for requests and responses: the decoded body as <hash>.txt next to
+# the request metadata as <hash>.json
 cache_path = '../cache/'
 os.makedirs(cache_path, exist_ok=True)
 
 # %% decode and encode
 
 str_reference = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789!\"#$%&'()*+,-./:;<=>?@[\\]^_`|~ \n"
-decode_map = {chr(k): v for (k, v) in zip(list(range(33,33 + len(str_reference))),str_reference)}
-encode_map = {v: k for (k, v) in decode_map.items()}
-decode_trans = str.maketrans(decode_map)
-encode_trans = str.maketrans(encode_map)
+decode_trans = bytes.maketrans(bytes(range(33, 33 + len(str_reference))), str_reference.encode('ascii'))
+encode_trans = bytes.maketrans(str_reference.encode('ascii'), bytes(range(33, 33 + len(str_reference))))
 
 def decode(s):
     assert isinstance(s, str), f"Expected string, got {type(s)}"
     assert s.startswith("S"), f"Expected string, got {s}"
-    return s[1:].translate(decode_trans)
+    return s.encode('ascii')[1:].translate(decode_trans).decode('ascii')
 
 def encode(s):
     assert isinstance(s, str), f"Expected string, got {type(s)}"
-    return "S" + s.translate(encode_trans)
+    return (b"S" + s.encode('ascii').translate(encode_trans)).decode('ascii')
 
 
 assert encode("Hello World!") == "SB%,,/}Q/2,$_", encode("Hello World!")
@@ -46,25 +56,117 @@ assert decode("SB%,,/}Q/2,$_") == "Hello World!", decode("SB%,,/}Q/2,$_")
 
 # %% cache requests with the server
 
-def request(s, force=False, nocode=False):
+# Outgoing posts are spaced post_interval seconds apart, but replies may overlap
+post_interval = 5
+post_lock = threading.Lock()
+next_post = 0.0
+
+# Futures for posts currently on the wire, keyed by cache path
+inflight = {}
+inflight_lock = threading.Lock()
+
+
+def wait_for_post_slot():
+    global next_post
+    with post_lock:
+        now = time.monotonic()
+        wait = max(0.0, next_post - now)
+        next_post = max(now, next_post) + post_interval
+    time.sleep(wait)
+
+
+def post(s, data, filepath):
+    wait_for_post_slot()
+    print("posting")
+    response = session.post(post_addr, data=data)
+    response.raise_for_status()
+    decoded = decode(response.text)
+    meta = {"request": s, "encoded": data, "response": response.text}
+    write_cache(filepath, decoded, meta)
+    return {**meta, "decoded": decoded}
+
+
+def write_cache(filepath, decoded, meta):
+    # The body goes last, its presence marks a complete entry
+    with open(filepath + '.json', 'w') as file:
+        json.dump(meta, file)
+    with open(filepath + '.txt', 'w', encoding='utf-8') as file:
+        file.write(decoded)
+
+
+def read_body(filepath):
+    with open(filepath + '.txt', 'r', encoding='utf-8') as file:
+        return file.read()
+
+
+def cache_file(s, nocode=False):
+    """ Encoded message and the cache path (without extension) for a request """
     if nocode:
         data = s
     else:
         assert isinstance(s, str), f"Expected string, got {type(s)}"
         assert not s.startswith("S"), "Send bare string not encoded"
         data = encode(s)
-    filename = hashlib.sha256(data.encode()).hexdigest()
-    filepath = os.path.join(cache_path, filename)
-    if force or not os.path.exists(filepath) and not force:
-        time.sleep(5)
-        print("posting")
-        response = requests.post(post_addr, headers=auth, data=data)
-        response.raise_for_status()
-        decoded = decode(response.text)
-        with open(filepath, 'w') as file:
-            json.dump({"request": s, "encoded":data, "response": response.text, "decoded": decoded}, file)
-    with open(filepath, 'r') as file:
-        return json.load(file)
+    filename = hashlib.blake2b(data.encode(), digest_size=20).hexdigest()
+    return data, os.path.join(cache_path, filename)
+
+
+def fetch(s, force=False, nocode=False):
+    """ Read a response from the on-disk cache, posting to the server on a miss """
+    data, filepath = cache_file(s, nocode)
+    need_fetch = force or not os.path.exists(filepath + '.txt')
+    if need_fetch:
+        # Only one thread posts a given message, the others wait for its reply
+        with inflight_lock:
+            future = inflight.get(filepath)
+            owner = future is None
+            if owner:
+                future = inflight[filepath] = Future()
+        if not owner:
+            return future.result()
+        try:
+            record = post(s, data, filepath)
+            future.set_result(record)
+            return record
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with inflight_lock:
+                del inflight[filepath]
+    with open(filepath + '.json', 'r') as file:
+        record = json.load(file)
+    record["decoded"] = read_body(filepath)
+    return record
+
+
+@functools.lru_cache(maxsize=4096)
+def cached_fetch(s, nocode=False):
+    return fetch(s, nocode=nocode)
+
+
+@functools.lru_cache(maxsize=4096)
+def request_body(s, nocode=False):
+    """ Decoded response only, skipping the metadata on cache hits """
+    _, filepath = cache_file(s, nocode)
+    try:
+        return read_body(filepath)
+    except FileNotFoundError:
+        return cached_fetch(s, nocode)["decoded"]
+
+
+def request(s, force=False, nocode=False):
+    """ Cached request, repeated calls are answered from memory """
+    if force:
+        return request_forced(s, nocode=nocode)
+    return cached_fetch(s, nocode)
+
+
+def request_forced(s, nocode=False):
+    """ Always post to the server, refreshing both caches """
+    cached_fetch.cache_clear()
+    request_body.cache_clear()
+    return fetch(s, force=True, nocode=nocode)
 
 # %% Get index
 # result = request('get index', force=True)
@@ -103,35 +205,43 @@ def request(s, force=False, nocode=False):
 # with open(os.path.join(ss_cache_path, 'info.txt'), 'w') as file:
 #     file.write(result['decoded'])
 # # %% Download spaceship levels
-# for i in range(1, 22):
+# def fetch_spaceship(i):
 #     path = f'../problems/spaceship/level{i}.txt'
 #     if not os.path.exists(path):
 #         msg = f"get spaceship{i}"
 #         result = request(msg)
 #         with open(path, 'w') as file:
 #             file.write(result['decoded'])
+# with ThreadPoolExecutor(max_workers=4) as executor:
+#     list(executor.map(fetch_spaceship, range(1, 22)))
 # %% Upload spaceship solutions
-for i in range(1, 30):
+def upload_spaceship(i):
     path = f'../problems/spaceship/solution{i}.txt'
     if os.path.exists(path):
         with open(path, 'r') as file:
             solution = file.read().strip()
         msg = f"solve spaceship{i} {solution}"
-        result = request(msg)
-        print(result['decoded'])
+        return request_body(msg)
+
+with ThreadPoolExecutor(max_workers=4) as executor:
+    for decoded in executor.map(upload_spaceship, range(1, 30)):
+        if decoded is not None:
+            print(decoded)
 
 # # %% get 3d info
 # result = request('get 3d', force=True)
 # with open('../problems/3d/info.txt', 'w') as file:
 #     file.write(result['decoded'])
 # # %% get 3d levels
-# for i in range(1, 13):
+# def fetch_3d(i):
 #     path = f"../problems/3d/level{i}.txt"
 #     if not os.path.exists(path):
 #         msg = f"get 3d{i}"
 #         result = request(msg)
 #         with open(path, 'w') as file:
 #             file.write(result['decoded'])
+# with ThreadPoolExecutor(max_workers=4) as executor:
+#     list(executor.map(fetch_3d, range(1, 13)))
 
 
 # # %% get language_test info
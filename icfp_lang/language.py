@@ -1,3 +1,4 @@
+from array import array
 from typing import Union
 
 from dataclasses import dataclass
@@ -11,10 +12,32 @@ class String:
         return Value(strings.decode(source))
 
 
+# Base-94 digits are the printable characters '!' (0) through '~' (93)
+base94_decode_table = bytes.maketrans(bytes(range(33, 127)), bytes(range(94)))
+base94_encode_table = bytes.maketrans(bytes(range(94)), bytes(range(33, 127)))
+
+
 class Integer:
     @staticmethod
     def parse(source: str) -> 'Value':
-        raise NotImplemented('Base94 integer parsing is not yet implemented')
+        value = 0
+        for digit in source[1:].encode('ascii').translate(base94_decode_table):
+            value = value * 94 + digit
+        return Value(value)
+
+    @staticmethod
+    def serialize(val: int) -> str:
+        """Encode a non-negative integer as an ICFP integer token"""
+        if val < 0:
+            raise ValueError('ICFP integers are non-negative, use U- for negation')
+        digits = bytearray()
+        while True:
+            val, digit = divmod(val, 94)
+            digits.append(digit)
+            if not val:
+                break
+        digits.reverse()
+        return 'I' + digits.translate(base94_encode_table).decode('ascii')
 
 
 class Boolean:
@@ -35,7 +58,28 @@ class Value:
 
     @staticmethod
     def parse(source: str) -> 'Value':
-        value_parse_lookup[source[0]](source)
+        return value_parse_lookup[source[0]].parse(source)
+
+    @staticmethod
+    def of(val: Union[int, bool, str]) -> 'Value':
+        """Shared Value for booleans, small integers and short strings"""
+        key = (type(val), val)
+        value = interned_values.get(key)
+        if value is None:
+            value = Value(val)
+            if not isinstance(val, int) or -1024 <= val <= 1024:
+                if not isinstance(val, str) or len(val) <= 16:
+                    interned_values[key] = value
+        return value
+
+
+interned_values = {}
+
+
+def trunc_div(a: int, b: int) -> int:
+    """Integer division truncated towards zero"""
+    q = abs(a) // abs(b)
+    return q if (a < 0) == (b < 0) else -q
 
 
 class UnaryOp:
@@ -47,7 +91,7 @@ class Neg(UnaryOp):
 
     @staticmethod
     def apply(val: Value) -> Value:
-        Value(-val.val)
+        return Value.of(-val.val)
 
 
 class Not(UnaryOp):
@@ -55,7 +99,7 @@ class Not(UnaryOp):
 
     @staticmethod
     def apply(val: Value) -> Value:
-        return Value(not val.val)
+        return Value.of(not val.val)
 
 
 class StrToInt(UnaryOp):
@@ -63,7 +107,7 @@ class StrToInt(UnaryOp):
 
     @staticmethod
     def apply(val: Value) -> Value:
-        Value(int(val.val))
+        return Integer.parse(strings.encode(val.val))
 
 
 class IntToStr(UnaryOp):
@@ -71,16 +115,7 @@ class IntToStr(UnaryOp):
 
     @staticmethod
     def apply(val: Value) -> Value:
-        Value(str(val.val))
-
-
-@dataclass
-class Unary:
-    op: Union[Neg, Not, StrToInt, IntToStr]
-    val: Value
-
-    def apply(self) -> Value:
-        return self.op.apply(self.val)
+        return String.parse(Integer.serialize(val.val))
 
 
 class BinaryOp:
@@ -106,7 +141,7 @@ class Add(BinaryOp):
 
     @staticmethod
     def apply(first: Value, second: Value) -> Value:
-        Value(first.val + second.val)
+        return Value.of(first.val + second.val)
 
 
 class Sub(BinaryOp):
@@ -114,25 +149,251 @@ class Sub(BinaryOp):
 
     @staticmethod
     def apply(first: Value, second: Value) -> Value:
-        Value(first.val - second.val)
+        return Value.of(first.val - second.val)
+
+
+class Mul(BinaryOp):
+    symbol = '*'
+
+    @staticmethod
+    def apply(first: Value, second: Value) -> Value:
+        return Value.of(first.val * second.val)
+
+
+class Div(BinaryOp):
+    symbol = '/'
+
+    @staticmethod
+    def apply(first: Value, second: Value) -> Value:
+        return Value.of(trunc_div(first.val, second.val))
+
+
+class Mod(BinaryOp):
+    symbol = '%'
+
+    @staticmethod
+    def apply(first: Value, second: Value) -> Value:
+        return Value.of(first.val - second.val * trunc_div(first.val, second.val))
+
+
+class Less(BinaryOp):
+    symbol = '<'
+
+    @staticmethod
+    def apply(first: Value, second: Value) -> Value:
+        return Value.of(first.val < second.val)
+
+
+class Greater(BinaryOp):
+    symbol = '>'
+
+    @staticmethod
+    def apply(first: Value, second: Value) -> Value:
+        return Value.of(first.val > second.val)
+
+
+class Equal(BinaryOp):
+    symbol = '='
+
+    @staticmethod
+    def apply(first: Value, second: Value) -> Value:
+        return Value.of(first is second or first.val == second.val)
+
+
+class Or(BinaryOp):
+    symbol = '|'
+
+    @staticmethod
+    def apply(first: Value, second: Value) -> Value:
+        return Value.of(first.val or second.val)
+
+
+class And(BinaryOp):
+    symbol = '&'
+
+    @staticmethod
+    def apply(first: Value, second: Value) -> Value:
+        return Value.of(first.val and second.val)
+
+
+class Concat(BinaryOp):
+    symbol = '.'
+
+    @staticmethod
+    def apply(first: Value, second: Value) -> Value:
+        return Value.of(first.val + second.val)
+
+
+class Take(BinaryOp):
+    symbol = 'T'
+
+    @staticmethod
+    def apply(first: Value, second: Value) -> Value:
+        return Value.of(second.val[:first.val])
+
+
+class Drop(BinaryOp):
+    symbol = 'D'
+
+    @staticmethod
+    def apply(first: Value, second: Value) -> Value:
+        return Value.of(second.val[first.val:])
+
+
+unary_ops = {op.symbol: op for op in (Neg, Not, StrToInt, IntToStr)}
+binary_ops = {op.symbol: op for op in (
+    Add, Sub, Mul, Div, Mod, Less, Greater, Equal, Or, And, Concat, Take, Drop)}
+
+
+# Expressions are stored flat: node i is (tag[i], a[i], b[i], c[i]) with
+# literal Values kept in a side list
+#   VALUE  constant index       LAMBDA var, body     VAR    var
+#   UNARY  op, x                BINARY op, x, y      APPLY  f, x
+#   IF     cond, then, else
+TAG_VALUE = 0
+TAG_VAR = 1
+TAG_LAMBDA = 2
+TAG_UNARY = 3
+TAG_BINARY = 4
+TAG_APPLY = 5
+TAG_IF = 6
+
+unary_op_list = list(unary_ops.values())
+binary_op_list = list(binary_ops.values())
+unary_op_index = {symbol: i for i, symbol in enumerate(unary_ops)}
+binary_op_index = {symbol: i for i, symbol in enumerate(binary_ops)}
+
+# Number of children and the column of the first child for each tag
+children = {TAG_LAMBDA: (1, 1), TAG_UNARY: (1, 1), TAG_BINARY: (2, 1), TAG_APPLY: (2, 0), TAG_IF: (3, 0)}
+
+
+class Nodes:
+    """Expression nodes as parallel integer columns"""
+
+    def __init__(self):
+        self.tag = array('b')
+        self.args = (array('q'), array('q'), array('q'))
+        self.constants = []
+
+    def __len__(self) -> int:
+        return len(self.tag)
+
+    def add(self, tag: int, a: int = 0) -> int:
+        self.tag.append(tag)
+        self.args[0].append(a)
+        self.args[1].append(0)
+        self.args[2].append(0)
+        return len(self.tag) - 1
+
+    def constant(self, value: 'Value') -> int:
+        self.constants.append(value)
+        return self.add(TAG_VALUE, len(self.constants) - 1)
 
 
 @dataclass
-class Binary:
-    op: Union[Add, Sub]
-    first: Value
-    second: Value
+class Tree:
+    nodes: Nodes
+    root: int
 
-    def apply(self) -> Value:
-        return self.op.apply(self.first, self.second)
 
+Expr = Union[Value, Tree]
 
-Expr = Union[Value, Unary, Binary]
 
-prefixes = {
-    'S': String,
-    'B': Boolean,
-}
+class Thunk:
+    """An unevaluated argument, evaluated at most once (call-by-need)"""
+    __slots__ = ('node', 'env', 'value')
+
+    def __init__(self, node: int, env: tuple):
+        self.node = node
+        self.env = env
+        self.value = None
+
+
+@dataclass
+class Closure:
+    var: int
+    body: int
+    env: tuple
+
+
+def lookup(env: tuple, var: int) -> Thunk:
+    # Environments are linked (var, thunk, parent) tuples, innermost first
+    while env is not None:
+        if env[0] == var:
+            return env[1]
+        env = env[2]
+    raise ValueError(f'Unbound variable {var}')
+
+
+# Continuation frame kinds
+FRAME_UPDATE = 0
+FRAME_UNARY = 1
+FRAME_LEFT = 2
+FRAME_RIGHT = 3
+FRAME_APPLY = 4
+FRAME_IF = 5
+
+
+def evaluate(nodes: Nodes, node: int, env: tuple = None) -> Union[Value, Closure]:
+    """Evaluate an expression with an explicit continuation stack"""
+    tags = nodes.tag
+    a, b, c = nodes.args
+    constants = nodes.constants
+    stack = []
+    while True:
+        # Descend until the expression reduces to a value
+        tag = tags[node]
+        if tag == TAG_VALUE:
+            value = constants[a[node]]
+        elif tag == TAG_VAR:
+            thunk = lookup(env, a[node])
+            if thunk.value is None:
+                stack.append((FRAME_UPDATE, thunk))
+                node, env = thunk.node, thunk.env
+                continue
+            value = thunk.value
+        elif tag == TAG_LAMBDA:
+            value = Closure(a[node], b[node], env)
+        elif tag == TAG_APPLY:
+            stack.append((FRAME_APPLY, Thunk(b[node], env)))
+            node = a[node]
+            continue
+        elif tag == TAG_UNARY:
+            stack.append((FRAME_UNARY, a[node]))
+            node = b[node]
+            continue
+        elif tag == TAG_BINARY:
+            stack.append((FRAME_LEFT, node, env))
+            node = b[node]
+            continue
+        else:
+            stack.append((FRAME_IF, node, env))
+            node = a[node]
+            continue
+        # Feed the value to pending continuations until one needs more evaluation
+        while stack:
+            frame = stack.pop()
+            kind = frame[0]
+            if kind == FRAME_UPDATE:
+                frame[1].value = value
+            elif kind == FRAME_UNARY:
+                value = unary_op_list[frame[1]].apply(value)
+            elif kind == FRAME_LEFT:
+                stack.append((FRAME_RIGHT, a[frame[1]], value))
+                node, env = c[frame[1]], frame[2]
+                break
+            elif kind == FRAME_RIGHT:
+                value = binary_op_list[frame[1]].apply(frame[2], value)
+            elif kind == FRAME_APPLY:
+                env = (value.var, frame[1], value.env)
+                node = value.body
+                break
+            else:
+                node, env = (b[frame[1]] if value.val else c[frame[1]]), frame[2]
+                break
+        else:
+            return value
+
 
 @dataclass
 class Program:
@@ -141,7 +402,49 @@ class Program:
 
     @staticmethod
     def parse(source: str) -> 'Program':
-        pass
+        tokens = source.split()
+        if len(tokens) == 1 and tokens[0][0] in value_parse_lookup:
+            return Program(Value.parse(tokens[0]))
+        nodes = Nodes()
+        # Prefix notation, so keep the nodes still waiting for children
+        # as [node, next column, last column]
+        pending = []
+        for token in tokens:
+            indicator = token[0]
+            if indicator == 'L':
+                node = nodes.add(TAG_LAMBDA, Integer.parse(token).val)
+            elif indicator == 'v':
+                node = nodes.add(TAG_VAR, Integer.parse(token).val)
+            elif indicator == 'U':
+                node = nodes.add(TAG_UNARY, unary_op_index[token[1]])
+            elif indicator == 'B' and token[1] == '$':
+                node = nodes.add(TAG_APPLY)
+            elif indicator == 'B':
+                node = nodes.add(TAG_BINARY, binary_op_index[token[1]])
+            elif indicator == '?':
+                node = nodes.add(TAG_IF)
+            else:
+                node = nodes.constant(Value.parse(token))
+            if pending:
+                parent = pending[-1]
+                nodes.args[parent[1]][parent[0]] = node
+                parent[1] += 1
+                if parent[1] == parent[2]:
+                    pending.pop()
+            elif node:
+                raise ValueError('Trailing tokens in ICFP program')
+            tag = nodes.tag[node]
+            if tag in children:
+                count, first = children[tag]
+                pending.append([node, first, first + count])
+        if pending or not nodes:
+            raise ValueError('Incomplete ICFP program')
+        return Program(Tree(nodes, 0))
+
+    def eval(self) -> Union[Value, Closure]:
+        if isinstance(self.expr, Value):
+            return self.expr
+        return evaluate(self.expr.nodes, self.expr.root)
 
 
 def encode(pgm: Program) -> str:
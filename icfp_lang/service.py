@@ -1,22 +1,36 @@
+import functools
+
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 from icfp_lang import language
 
 competition_server = 'https://boundvariable.space/communicate'
 
+# Keep the TLS connection to the server alive between messages
+session = requests.Session()
+session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=4, max_retries=Retry(
+    total=3, backoff_factor=2, status_forcelist=[429, 502, 503], allowed_methods=['POST'])))
+
 def message(msg: str) -> language.Program:
     return language.decode(send(language.Program(language.Value(msg))))
 
 
 def send(program: language.Program) -> str:
     program_message = language.encode(program)
-    auth_header = read_auth_header()
-    (key, val) = auth_header.split(': ')
-    response = requests.post(
-        competition_server, data=program_message, headers={key: val})
+    response = session.post(
+        competition_server, data=program_message, headers=auth_headers())
     return str(response.content, 'utf-8')
 
 
+@functools.lru_cache(maxsize=None)
+def auth_headers() -> dict:
+    """Auth header for the server, read from disk on first use only"""
+    (key, val) = read_auth_header().split(': ', 1)
+    return {key: val}
+
+
 def read_auth_header() -> str:
     with open('misc/SUBMISSION_HEADER.txt') as auth_header:
         return auth_header.readlines()[0].strip()
@@ -1,22 +1,65 @@
 #!/usr/bin/env python
 # %% lambdaman solver
 import os
-import random
 import time
-from dataclasses import dataclass
-from PIL import Image, ImageDraw
+from collections import deque
+from dataclasses import dataclass, field
+import numpy as np
+from PIL import Image
+
+
+# Grid cells are stored as their raw ASCII bytes
+WALL = ord('#')
+PILL = ord('.')
+LAMBDA = ord('L')
+EMPTY = ord(' ')
+
+# Render colors: walls blue, pills green, Lambda red, empty black
+CELL_COLORS = {WALL: (0, 0, 255, 255), PILL: (0, 255, 0, 255), LAMBDA: (255, 0, 0, 255), EMPTY: (0, 0, 0, 255)}
+CELL_RGBA = np.zeros((256, 4), dtype=np.uint8)
+CELL_RGBA[list(CELL_COLORS)] = list(CELL_COLORS.values())
+
+# Row/column offset for each move
+STEPS = {'U': (-1, 0), 'R': (0, 1), 'D': (1, 0), 'L': (0, -1)}
+DIRS = tuple(STEPS.values())
+
+
+def trace(parent, dst, width):
+    """ Directions along a flat parent array from its root to dst """
+    # Keyed by signed offset. On a one-column grid U and D share their keys
+    # with L and R, and come last so they win: there are no sideways moves.
+    moves = {-1: 'L', 1: 'R', -width: 'U', width: 'D'}
+    path = []
+    src = int(parent[dst])
+    while src >= 0:
+        path.append(moves[dst - src])
+        dst, src = src, int(parent[src])
+    return ''.join(reversed(path))
 
 
 @dataclass
 class Level:
     i: int
-    grid: list  # list of lists
-    solution: str = ''
+    grid: np.ndarray  # (height, width) uint8 view of buf
+    moves: bytearray = field(default_factory=bytearray)  # solution so far, as ASCII directions
+    buf: bytearray = field(init=False, repr=False)  # row-major cell bytes, index x * width + y
+    _L: tuple = field(init=False, repr=False)
+    _pills: set = field(init=False, repr=False)  # remaining pill locations
+
+    def __post_init__(self):
+        # Cells live in one flat buffer, the grid array is a view sharing its memory
+        self.buf = bytearray(np.ascontiguousarray(self.grid, dtype=np.uint8).tobytes())
+        self.grid = np.frombuffer(self.buf, dtype=np.uint8).reshape(self.grid.shape)
+        # Scan once, then keep Lambda and the pills up to date in step()
+        self._L = self.find_L()
+        self._pills = set(map(tuple, np.argwhere(self.grid == PILL).tolist()))
 
     @classmethod
     def load(cls, i: int):
         with open(f"level{i}.txt") as f:
-            grid = [list(row) for row in f.read().strip().splitlines()]
+            rows = f.read().strip().splitlines()
+        grid = np.frombuffer(''.join(rows).encode(), dtype=np.uint8)
+        grid = grid.reshape(len(rows), len(rows[0]))
         solution = f"solution{i}.txt"
         level = cls(i, grid)
         # if os.path.exists(solution):
@@ -25,136 +68,106 @@ class Level:
         return level
 
     def __str__(self):
-        return self.solution + "\n" + "\n".join("".join(row) for row in self.grid)
+        return self.solution + "\n" + "\n".join(row.tobytes().decode() for row in self.grid)
 
     @property
     def height(self):
-        return len(self.grid)
+        return self.grid.shape[0]
     
     @property
     def width(self):
-        return len(self.grid[0])
+        return self.grid.shape[1]
 
     @property
     def remaining(self):
         """ number of remaining pills """
-        return sum(row.count('.') for row in self.grid)
+        return len(self._pills)
     
     @property
     def solved(self):
         return self.remaining == 0
     
+    @property
+    def solution(self):
+        return self.moves.decode()
+
     @property
     def score(self):
-        return len(self.solution) if self.solved else None
+        return len(self.moves) if self.solved else None
     
     @property
     def L(self):
         """ location of Lambda in the grid """
-        for i, row in enumerate(self.grid):
-            if 'L' in row:
-                return (i, row.index('L'))
-        raise ValueError("No Lambda in the grid")
-
-    def direction(self, src, dst):
-        """ Get the direction from src to dst """
-        assert src != dst, f"Invalid direction: {src} -> {dst}"
-        x1, y1 = src
-        x2, y2 = dst
-        if x1 < x2:
-            assert y1 == y2, f"Invalid direction: {src} -> {dst}"
-            return 'D'
-        elif x1 > x2:
-            assert y1 == y2, f"Invalid direction: {src} -> {dst}"
-            return 'U'
-        elif y1 < y2:
-            assert x1 == x2, f"Invalid direction: {src} -> {dst}"
-            return 'R'
-        elif y1 > y2:
-            assert x1 == x2, f"Invalid direction: {src} -> {dst}"
-            return 'L'
-        else:
-            raise ValueError(f"Invalid direction: {src} -> {dst}")
-
-    def dist(self, src, dst):
-        """ Manhattan distance """
-        return abs(src[0] - dst[0]) + abs(src[1] - dst[1])
+        return self._L
+
+    def find_L(self):
+        """ Scan the grid for Lambda """
+        found = self.buf.find(LAMBDA)
+        if found < 0:
+            raise ValueError("No Lambda in the grid")
+        return divmod(found, self.width)
 
     def neighbors(self, x, y):
         """ Neighbors of a location """
-        for dx, dy in [(0, 1), (1, 0), (0, -1), (-1, 0)]:
+        height, width = self.grid.shape
+        buf = self.buf
+        for dx, dy in DIRS:
             nx, ny = x + dx, y + dy
-            if 0 <= nx < self.height and 0 <= ny < self.width and self.grid[nx][ny] != '#':
+            if 0 <= nx < height and 0 <= ny < width and buf[nx * width + ny] != WALL:
                 yield (nx, ny)
 
     def pills(self):
-        """ Remaining pill locations, sorted by distance to Lambda """
-        locations = []
-        for i, row in enumerate(self.grid):
-            for j, cell in enumerate(row):
-                if cell == '.':
-                    locations.append((i, j))
-        return locations
-
-    def closest(self):
-        """ Get (a) closest pill """
-        L = self.L
-        pills = self.pills()
-        dist = min(self.dist(L, pill) for pill in pills)
-        options = [pill for pill in pills if self.dist(L, pill) == dist]
-        return random.choice(options)
+        """ Remaining pill locations """
+        return self._pills
 
     def step(self, direction):
         """ Step lambda in a direction """
-        assert direction in 'URDL', f"Invalid direction: {direction}"
+        offset = STEPS.get(direction)
+        if offset is None:
+            raise ValueError("Invalid direction: %r" % (direction,))
+        x, y = self._L
+        new_x, new_y = x + offset[0], y + offset[1]
+        height, width = self.grid.shape
+        if not (0 <= new_x < height and 0 <= new_y < width):
+            raise ValueError("Invalid move: %s" % direction)
+        src, dst = x * width + y, new_x * width + new_y
+        target = self.buf[dst]
+        if target == WALL:
+            raise ValueError("Invalid move: %s" % direction)
+        if target == PILL:
+            self._pills.remove((new_x, new_y))
+        self.buf[src] = EMPTY
+        self.buf[dst] = LAMBDA
+        self._L = (new_x, new_y)
+        self.moves.append(ord(direction))
+
+    def path_to_pill(self):
+        """ Directions to the nearest pill, from a BFS that stops at the first one found """
+        buf, w = self.buf, self.width
+        size = len(buf)
         x, y = self.L
-        dx, dy = {'U': (-1, 0), 'R': (0, 1), 'D': (1, 0), 'L': (0, -1)}[direction]
-        new_x, new_y = x + dx, y + dy
-        if 0 <= new_x < self.height and 0 <= new_y < self.width and self.grid[new_x][new_y] != '#':
-            self.grid[x][y] = ' '
-            self.grid[new_x][new_y] = 'L'
-            self.solution += direction
-        else:
-            raise ValueError(f"Invalid move: {direction}")
-
-    def astar(self, dst):
-        """ Compute shortest path from Lambda to destination """
-        # Use manhattan distance as heuristic
-        def h(node):
-            return self.dist(node, dst)
-        
-        # A* search
-        start = self.L
-        frontier = [(h(start), start)]
-        came_from = {start: None}
-        cost_so_far = {start: 0}
-        while frontier:
-            frontier.sort()
-            _, current = frontier.pop(0)
-            if current == dst:
-                break
-            for neighbor in self.neighbors(*current):
-                new_cost = cost_so_far[current] + 1
-                if neighbor not in cost_so_far or new_cost < cost_so_far[neighbor]:
-                    cost_so_far[neighbor] = new_cost
-                    priority = new_cost + h(neighbor)
-                    frontier.append((priority, neighbor))
-                    came_from[neighbor] = current
-        # Reconstruct path
-        path = []
-        while current != start:
-            path.append(current)
-            current = came_from[current]
-        path.append(start)
-        path.reverse()
-        # Convert to directions
-        for i in range(len(path) - 1):
-            self.step(self.direction(path[i], path[i + 1]))
-    
+        start = x * w + y
+        # parent doubles as the visited set, so short searches never touch the whole grid
+        parent = {start: -1}
+        queue = deque([start])
+        while queue:
+            current = queue.popleft()
+            if buf[current] == PILL:
+                return trace(parent, current, w)
+            col = current % w
+            for neighbor in (current - w, current + w,
+                             current - 1 if col > 0 else -1,
+                             current + 1 if col < w - 1 else -1):
+                if 0 <= neighbor < size and neighbor not in parent and buf[neighbor] != WALL:
+                    parent[neighbor] = current
+                    queue.append(neighbor)
+        raise ValueError("No reachable pills")
+
     def solve(self):
         """ always move to the closest pill """
         while not self.solved:
-            self.astar(self.closest())
+            for direction in self.path_to_pill():
+                self.step(direction)
         return self
 
     def save(self):
@@ -173,30 +186,22 @@ class Level:
 
     def render(self, big=400, filename=None):
         assert self.width < 1000 and self.height < 1000, f"too big {self.width} x {self.height}"
-        # Create a blank image
-        img = Image.new('RGBA', (self.width, self.height), 'black')
-        draw = ImageDraw.Draw(img)
-        # Draw the grid
-        for i, row in enumerate(self.grid):
-            for j, cell in enumerate(row):
-                if cell == '#':  # Blue
-                    draw.point([(j, i)], fill=(0, 0, 255, 255))
-                elif cell == '.':  # Green
-                    draw.point([(j, i)], fill=(0, 255, 0, 255))
-                elif cell == 'L':  # Red
-                    draw.point([(j, i)], fill=(255, 0, 0, 255))
-                else:  # Black
-                    assert cell == ' ', cell
-                    draw.point([(j, i)], fill=(0, 0, 0, 255))
+        unknown = np.setdiff1d(self.grid, list(CELL_COLORS))
+        assert not len(unknown), unknown
+        # Look every cell's color up in one vectorised gather
+        img = Image.fromarray(CELL_RGBA[self.grid], 'RGBA')
+        img = self.upscale(img, big)
+        if filename:
+            img.save(filename)
+            print("Saved", filename)
+        return img
 
+    def upscale(self, img, big=400):
+        """ Scale an image of the grid up so its smaller side is about big pixels """
         if self.width < big or self.height < big:
             scale = big // max(self.width, self.height)
             size = (self.width * scale, self.height * scale)
             img = img.resize(size, resample=Image.Resampling.NEAREST)
-
-        if filename:
-            img.save(filename)
-            print("Saved", filename)
         return img
 
     def animate(self, duration=300, big=400, solution=None, filename=None):
@@ -204,24 +209,41 @@ class Level:
             with open(f"solution{self.i}.txt") as f:
                 solution = f.read().strip()
         assert len(solution) < 1000, f"Solution too long {len(solution)}"
-        images = [self.render(big=big)]
-        for move in solution:
-            self.step(move)
-            images.append(self.render(big=big))
+        # Render once, then only repaint the two cells each move touches
+        img = self.render(big=0)
+
+        def frames():
+            for move in solution:
+                x, y = self.L
+                self.step(move)
+                new_x, new_y = self.L
+                img.putpixel((y, x), (0, 0, 0, 255))
+                img.putpixel((new_y, new_x), (255, 0, 0, 255))
+                yield self.upscale(img, big)
 
         filename = filename or f'animation{self.i}.gif'
-        images[0].save(filename,
-               save_all=True, append_images=images[1:],
+        self.upscale(img, big).save(filename,
+               save_all=True, append_images=frames(),
                optimize=False, duration=duration, loop=0)
         print("Saved", filename)
 
 
+def stale(target, *sources):
+    """ True if target is missing or older than any existing source file """
+    if not os.path.exists(target):
+        return True
+    mtime = os.stat(target).st_mtime
+    return any(os.stat(src).st_mtime > mtime for src in sources if os.path.exists(src))
+
+
+# Only redraw outputs whose level or solution changed since they were written
 for i in range(30):
     if os.path.exists(f'level{i}.txt'):
         print(f"level {i}")
-        level = Level.load(i)
-        level.render(filename=f"level{i}.png")
-        try:
-            Level.load(i).animate()
-        except Exception as e:
-            print(e)
\ No newline at end of file
+        if stale(f"level{i}.png", f"level{i}.txt"):
+            Level.load(i).render(filename=f"level{i}.png")
+        if stale(f"animation{i}.gif", f"level{i}.txt", f"solution{i}.txt"):
+            try:
+                Level.load(i).animate()
+            except Exception as e:
+                print(e)
\ No newline at end of file
@@ -1,15 +1,20 @@
 #!/usr/bin/env python
 # %% translate icfp language to scheme
+import codecs
 import sys
 import subprocess
 import tempfile
 import os
+from concurrent.futures import ThreadPoolExecutor
+
+# Base-94 digit characters '!'..'~' to digit values 0..93
+b94_digits = bytes.maketrans(bytes(range(33, 127)), bytes(range(94)))
+
 
 def c2b94(s):
     value = 0
-    for c in s:
-        value *= 94
-        value += ord(c) - 33
+    for digit in s.encode('ascii').translate(b94_digits):
+        value = value * 94 + digit
     return value
 
 
@@ -17,27 +22,43 @@ def b942c(value):
     assert isinstance(value, int) and value >= 0, value
     if value == 0:
         return '!'
-    s = ""
+    digits = bytearray()
     while value:
         value, r = divmod(value, 94)
-        s = chr(r + 33) + s
-    return s
+        digits.append(r + 33)
+    digits.reverse()
+    return digits.decode('ascii')
 
 
 str_reference = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789!\"#$%&'()*+,-./:;<=>?@[\\]^_`|~ \n"
 decode_map = {chr(k): v for (k, v) in zip(list(range(33,33 + len(str_reference))),str_reference)}
 encode_map = {v: k for (k, v) in decode_map.items()}
-decode_trans = str.maketrans(decode_map)
-encode_trans = str.maketrans(encode_map)
+# Byte-level tables; str.translate would look every character up in a dict
+decode_trans = bytes.maketrans(''.join(decode_map).encode('latin1'), ''.join(decode_map.values()).encode('latin1'))
+encode_trans = bytes.maketrans(''.join(encode_map).encode('latin1'), ''.join(encode_map.values()).encode('latin1'))
 
 
 def decode(s):
     assert isinstance(s, str), f"Expected string, got {type(s)}"
-    return s.translate(decode_trans)
+    return s.encode('latin1').translate(decode_trans).decode('latin1')
 
 def encode(s):
     assert isinstance(s, str), f"Expected string, got {type(s)}"
-    return s.translate(encode_trans)
+    return s.encode('latin1').translate(encode_trans).decode('latin1')
+
+
+def icfp94_search(name):
+    """ Codec lookup so raw ICFP bytes can be read with data.decode('icfp94') """
+    if name != 'icfp94':
+        return None
+    return codecs.CodecInfo(
+        name='icfp94',
+        encode=lambda s, errors='strict': (s.encode('latin1').translate(encode_trans), len(s)),
+        decode=lambda b, errors='strict': (bytes(b).translate(decode_trans).decode('latin1'), len(b)),
+    )
+
+
+codecs.register(icfp94_search)
 
 
 class Node:
@@ -49,42 +70,56 @@ class Node:
 def tokenize(icfp_code):
     return icfp_code.split()
 
+# Number of child expressions following each indicator
+arity = {'U': 1, 'L': 1, 'B': 2, '?': 3}
+
+
+def make_node(token, children):
+    if token[0] in 'TF':
+        return Node('bool', token)
+    elif token[0] == 'I':
+        return Node('int', token[1:])
+    elif token[0] == 'S':
+        return Node('string', decode(token[1:]))
+    elif token[0] == 'U':
+        return Node('unary', token[1], children)
+    elif token[0] == 'B':
+        return Node('binary', token[1], children)
+    elif token[0] == '?':
+        return Node('if', None, children)
+    elif token[0] == 'L':
+        return Node('lambda', token[1:], children)
+    elif token[0] == 'v':
+        return Node('var', token[1:])
+    else:
+        return Node('unknown', token)
+
+
 def parse(tokens):
-    def parse_expression(index):
-        if index >= len(tokens):
-            return None, index
-        
-        token = tokens[index]
-        if token[0] in 'TF':
-            return Node('bool', token), index + 1
-        elif token[0] == 'I':
-            return Node('int', token[1:]), index + 1
-        elif token[0] == 'S':
-            return Node('string', decode(token[1:])), index + 1
-        elif token[0] == 'U':
-            node, next_index = parse_expression(index + 1)
-            return Node('unary', token[1], [node]), next_index
-        elif token[0] == 'B':
-            left, next_index = parse_expression(index + 1)
-            right, next_index = parse_expression(next_index)
-            return Node('binary', token[1], [left, right]), next_index
-        elif token[0] == '?':
-            cond, next_index = parse_expression(index + 1)
-            true_branch, next_index = parse_expression(next_index)
-            false_branch, next_index = parse_expression(next_index)
-            return Node('if', None, [cond, true_branch, false_branch]), next_index
-        elif token[0] == 'L':
-            body, next_index = parse_expression(index + 1)
-            return Node('lambda', token[1:], [body]), next_index
-        elif token[0] == 'v':
-            return Node('var', token[1:]), index + 1
-        else:
-            return Node('unknown', token), index + 1
-
-    root, _ = parse_expression(0)
-    return root
-
-def emit_scheme(node):
+    # Prefix notation reads right to left as postfix, so children are
+    # already on the stack when their parent's token comes up. Identical
+    # subtrees are shared so emit_scheme only renders them once.
+    shared = {}
+    stack = []
+    for token in reversed(tokens):
+        n = arity.get(token[0], 0)
+        children = stack[:-n - 1:-1] if n else []
+        del stack[len(stack) - n:]
+        key = (token, tuple(map(id, children)))
+        node = shared.get(key)
+        if node is None:
+            node = shared[key] = make_node(token, children)
+        stack.append(node)
+    return stack[-1] if stack else None
+
+
+unary_ops = {'-': '-', '!': 'not', '#': 'string->number', '$': 'number->string'}
+binary_ops = {'+': '+', '-': '-', '*': '*', '/': 'quotient', '%': 'remainder',
+              '<': '<', '>': '>', '=': '=', '|': 'or', '&': 'and', '.': 'string-append'}
+
+
+def emit_node(node, args):
+    """ Scheme for a node given the already emitted scheme of its children """
     if node.type == 'bool':
         return '#t' if node.value == 'T' else '#f'
     elif node.type == 'int':
@@ -93,28 +128,42 @@ def emit_scheme(node):
         # Simplified string conversion
         return f'"{node.value}"'
     elif node.type == 'unary':
-        op = {'-': '-', '!': 'not', '#': 'string->number', '$': 'number->string'}[node.value]
-        return f'({op} {emit_scheme(node.children[0])})'
+        return f'({unary_ops[node.value]} {args[0]})'
     elif node.type == 'binary':
         if node.value == '$':
             # Special handling for application
-            func = emit_scheme(node.children[0])
-            arg = emit_scheme(node.children[1])
-            return f'({func} {arg})'
-        op = {'+': '+', '-': '-', '*': '*', '/': 'quotient', '%': 'remainder',
-              '<': '<', '>': '>', '=': '=', '|': 'or', '&': 'and', '.': 'string-append'}[node.value]
-        return f'({op} {emit_scheme(node.children[0])} {emit_scheme(node.children[1])})'
+            return f'({args[0]} {args[1]})'
+        return f'({binary_ops[node.value]} {args[0]} {args[1]})'
     elif node.type == 'if':
-        return f'(if {emit_scheme(node.children[0])} {emit_scheme(node.children[1])} {emit_scheme(node.children[2])})'
+        return f'(if {args[0]} {args[1]} {args[2]})'
     elif node.type == 'lambda':
         var_num = c2b94(node.value)
-        return f'(lambda (v{var_num}) {emit_scheme(node.children[0])})'
+        return f'(lambda (v{var_num}) {args[0]})'
     elif node.type == 'var':
         var_num = c2b94(node.value)
         return f'v{var_num}'
     else:
         return node.value  # Unknown node type
 
+
+def emit_scheme(root):
+    # Post-order walk with an explicit stack, emitting each shared node once
+    emitted = {}
+    stack = [root]
+    while stack:
+        node = stack[-1]
+        if id(node) in emitted:
+            stack.pop()
+            continue
+        pending = [child for child in node.children if id(child) not in emitted]
+        if pending:
+            stack.extend(pending)
+            continue
+        stack.pop()
+        emitted[id(node)] = emit_node(node, [emitted[id(child)] for child in node.children])
+    return emitted[id(root)]
+
+
 def icfp_to_scheme(icfp_code):
     tokens = tokenize(icfp_code)
     parse_tree = parse(tokens)
@@ -134,5 +183,18 @@ def main(name):
     print("Generated", output_file)
 
 
+def main_all(directory='.'):
+    """ Translate and compile every level*.icfp in directory in parallel """
+    with os.scandir(directory) as entries:
+        names = [os.path.join(directory, entry.name[:-len('.icfp')]) for entry in entries
+                 if entry.name.startswith('level') and entry.name.endswith('.icfp')]
+    # csc runs in its own process, so threads are enough to keep every core busy
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+        list(executor.map(main, sorted(names)))
+
+
 if __name__ == '__main__':
-    main('level10')
\ No newline at end of file
+    if sys.argv[1:] == ['all']:
+        main_all()
+    else:
+        main('level10')
\ No newline at end of file
@@ -1,27 +1,35 @@
 #!/usr/bin/env python
 # %%
 from typing import List, Optional, Dict
-from dataclasses import dataclass
-import random
-import math
+import itertools
+import operator
 import time
 import requests
 import os
 
+# Trace every reduction and replacement, slow on real programs
+DEBUG = False
+
 
 def truncdiv(a, b):
-    return math.trunc(a / b)
+    q, r = divmod(a, b)
+    return q + 1 if r and (a < 0) != (b < 0) else q
 
 
 def truncmod(a, b):
     return a - b * truncdiv(a, b)
 
 
+# Base-94 digit characters '!'..'~' to digit values 0..93
+b94_digits = bytes.maketrans(bytes(range(33, 127)), bytes(range(94)))
+# Every pair of base-94 digits, so b942c peels off two per divmod
+b94_pairs = [bytes((hi, lo)) for hi in range(33, 127) for lo in range(33, 127)]
+
+
 def c2b94(s):
     value = 0
-    for c in s:
-        value *= 94
-        value += ord(c) - 33
+    for digit in s.encode('ascii').translate(b94_digits):
+        value = value * 94 + digit
     return value
 
 
@@ -29,53 +37,67 @@ def b942c(value):
     assert isinstance(value, int) and value >= 0, value
     if value == 0:
         return '!'
-    s = ""
+    pairs = []
     while value:
-        value, r = divmod(value, 94)
-        s = chr(r + 33) + s
-    return s
+        value, r = divmod(value, 94 * 94)
+        pairs.append(b94_pairs[r])
+    pairs.reverse()
+    return b''.join(pairs).lstrip(b'!').decode('ascii')
 
 
 str_reference = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789!\"#$%&'()*+,-./:;<=>?@[\\]^_`|~ \n"
-decode_map = {chr(k): v for (k, v) in zip(list(range(33,33 + len(str_reference))),str_reference)}
-encode_map = {v: k for (k, v) in decode_map.items()}
-decode_trans = str.maketrans(decode_map)
-encode_trans = str.maketrans(encode_map)
+decode_trans = bytes.maketrans(bytes(range(33, 33 + len(str_reference))), str_reference.encode('latin1'))
+encode_trans = bytes.maketrans(str_reference.encode('latin1'), bytes(range(33, 33 + len(str_reference))))
 
 
 def decode(s):
-    assert isinstance(s, str), f"Expected string, got {type(s)}"
-    return s.translate(decode_trans)
+    return s.encode('latin1').translate(decode_trans).decode('latin1')
 
 def encode(s):
-    assert isinstance(s, str), f"Expected string, got {type(s)}"
-    return s.translate(encode_trans)
+    return s.encode('latin1').translate(encode_trans).decode('latin1')
 
 
 def escape(s):
     return s.replace('"', '\\"')
 
 
+# Value type of each leaf indicator
+value_tags = {'I': 'int', 'T': 'bool', 'F': 'bool', 'S': 'str'}
 
-@dataclass
-class Node:
-    token: str
-    children: Optional[List['Node']] = None
-    substitutions: Optional[Dict[str, 'Node']] = None
-    parent: Optional['Node'] = None
 
-    def __post_init__(self):
-        if self.children:
-            for child in self.children:
+class Node:
+    __slots__ = ('token', 'indicator', 'body', 'children', 'substitutions', 'parent', 'fragments', 'type_tag', 'shape')
+
+    def __init__(self, token: str, children: Optional[List['Node']] = None,
+                 substitutions: Optional[Dict[str, 'Node']] = None, parent: Optional['Node'] = None):
+        self.children = children
+        self.substitutions = substitutions
+        self.parent = parent
+        # Pieces of a string built by B., joined only once the string is read
+        self.fragments = None
+        # Structure id from parse, cleared once evaluation reaches the node
+        self.shape = None
+        self.set_token(token)
+        if children:
+            for child in children:
                 child.parent = self
 
-    @property
-    def indicator(self):
-        return self.token[0]
-    
-    @property
-    def body(self):
-        return self.token[1:]
+    def set_token(self, token):
+        # indicator and body are read on every step, so keep them as
+        # plain attributes rather than slicing the token each time
+        self.token = token
+        self.indicator = token[0]
+        self.body = token[1:]
+        self.retag()
+
+    def retag(self):
+        # Value type as 'int', 'bool', 'str' or None, so the is* checks
+        # don't recurse through U- and U! on every reduction
+        if self.token == 'U-' or self.token == 'U!':
+            tag = self.children[0].type_tag
+            self.type_tag = tag if tag == ('int' if self.token == 'U-' else 'bool') else None
+        else:
+            self.type_tag = value_tags.get(self.indicator)
     
     def size(self):
         s = 1
@@ -105,21 +127,13 @@ class Node:
                 child.check()
     
     def isint(self):
-        if self.indicator == 'I':
-            return True
-        if self.token == 'U-':
-            return self.children[0].isint()
-        return False
+        return self.type_tag == 'int'
     
     def isbool(self):
-        if self.token in ('T', 'F'):
-            return True
-        if self.token == 'U!':
-            return self.children[0].isbool()
-        return False
+        return self.type_tag == 'bool'
     
     def isstr(self):
-        return self.indicator == 'S'
+        return self.type_tag == 'str'
 
     def asint(self):
         if self.indicator == 'I':
@@ -139,11 +153,22 @@ class Node:
     
     def asstr(self):
         if self.indicator == 'S':
+            self.flatten()
             return self.body
         raise ValueError(f"Expected string, got {self.token}")
     
+    def pieces(self):
+        return self.fragments if self.fragments is not None else [self.body]
+
+    def flatten(self):
+        if self.fragments is not None:
+            self.set_token('S' + ''.join(self.fragments))
+            self.fragments = None
+
     @classmethod
     def fromint(cls, value):
+        if 0 <= value < len(small_ints):
+            return small_ints[value]
         if value >= 0:
             return cls('I' + b942c(value))
         return cls('U-', [cls('I' + b942c(-value))])
@@ -161,6 +186,7 @@ class Node:
             self.substitutions[new_var] = replacement
 
     def dump(self):
+        self.flatten()
         s = self.token
         if self.children:
             for child in self.children:
@@ -173,35 +199,52 @@ class Node:
         return s
 
     def lookup(self, v):
-        if self.substitutions and v in self.substitutions:
-            return self.substitutions[v]
-        return self.parent.lookup(v) if self.parent else None
+        node = self
+        while node is not None:
+            if node.substitutions and v in node.substitutions:
+                return node.substitutions[v]
+            node = node.parent
+        return None
 
     def rename(self, a, b):
         assert isinstance(a, str) and a.startswith('v') and len(a) > 1, a
         assert isinstance(b, str) and b.startswith('v') and len(b) > 1, b
         assert a != b, f"{a} == {b}"
-        if self.indicator == 'v' and self.token == a:
-            self.token = b
-        if self.indicator == 'L' and self.body == a[1:]:
-            return  # Stop renaming at next lambda boundary which matches
-        if self.children:
-            for child in self.children:
-                child.rename(a, b)
-        if self.substitutions:
-            for value in self.substitutions.values():
-                value.rename(a, b)
+        # Substitution values are shared between many environments, so
+        # visit each node once rather than once per path leading to it
+        seen = set()
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            if id(node) in seen:
+                continue
+            seen.add(id(node))
+            if node.indicator == 'v' and node.token == a:
+                node.set_token(b)
+            if node.indicator == 'L' and node.body == a[1:]:
+                continue  # Stop renaming at next lambda boundary which matches
+            if node.children:
+                stack.extend(node.children)
+            if node.substitutions:
+                stack.extend(node.substitutions.values())
 
     def replace(self, node, parent=None):
-        print(f"replacing {self.token} id {id(self)} with {node.token} id {id(node)} values")
+        if DEBUG:
+            print(f"replacing {self.token} id {id(self)} with {node.token} id {id(node)} values")
         self.substitutions = node.substitutions
         self.children = node.children
         if self.children:
             for child in self.children:
                 child.parent = self
-        self.token = node.token
+        self.set_token(node.token)
+        self.fragments = node.fragments
         if parent:
             self.parent = parent
+        # U- and U! ancestors take their value type from this node
+        ancestor = self.parent
+        while ancestor is not None and ancestor.token in ('U-', 'U!'):
+            ancestor.retag()
+            ancestor = ancestor.parent
         return True  # returned for convenience with step logic
     
     def squeeze(self, rep, nodes):
@@ -210,22 +253,25 @@ class Node:
         return self.replace(rep)
 
     def all_nodes(self):
-        s = {id(self): self}
-        if self.children:
-            for child in self.children:
-                if id(child) not in s:
-                    s.update(child.all_nodes())
+        s = {}
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            if id(node) not in s:
+                s[id(node)] = node
+                if node.children:
+                    stack.extend(node.children)
         return s
 
     def dotedges(self):
-        s = set()
+        # all_nodes already reaches every descendant, one pass over it is enough
+        s = []
         for node in self.all_nodes().values():
             if node.children:
                 for child in node.children:
-                    s.add(f"id{id(node)} -> id{id(child)};\n")
-                    s.update(child.dotedges())
+                    s.append(f"id{id(node)} -> id{id(child)};\n")
             if node.parent:
-                s.add(f"id{id(node)} -> id{id(node.parent)} [color=red];\n")
+                s.append(f"id{id(node)} -> id{id(node.parent)} [color=red];\n")
         return s
     
     def dotnodes(self):
@@ -235,6 +281,7 @@ class Node:
         return s
 
     def dotlabel(self):
+        self.flatten()
         s = escape(self.token)
         if self.indicator == 'I':
             s += f" == ({self.asint()})"
@@ -265,32 +312,214 @@ class Node:
         print("Wrote dot to", filename, "and svg to", svgfile)
 
 
+# Suffixes for renamed bound variables, the underscore keeps them apart
+# from short names in the source program
+fresh_vars = itertools.count(1)
+
+# Shared result leaves. replace() copies their token into the target and
+# their children and substitutions are None, so nothing of theirs ends up
+# in the tree. Nodes with children can't be shared this way: replace()
+# hands the children over by reference and re-parents them.
+true_node = Node('T')
+false_node = Node('F')
+
+
+# Non-negative results of arithmetic near zero, shared like true_node and
+# false_node above. Negative results are U- nodes, built fresh each time.
+small_ints = [Node('I' + b942c(i)) for i in range(4096)]
+
+
+# Hash-consed structure of parsed subtrees: (token, child shapes) -> shape
+shapes = {}
+# Free variables of each shape, indexed by shape
+shape_free_vars = []
+# Value of every closed B$ shape evaluated so far
+value_memo = {}
+
+
+def shape_of(token, children):
+    key = (token, tuple(child.shape for child in children))
+    shape = shapes.get(key)
+    if shape is None:
+        if token[0] == 'v':
+            free = frozenset([token])
+        else:
+            free = frozenset().union(*(shape_free_vars[child] for child in key[1]))
+            if token[0] == 'L':
+                free = free - {'v' + token[1:]}
+        shape = shapes[key] = len(shape_free_vars)
+        shape_free_vars.append(free)
+    return shape
+
+
+def value_copy(node):
+    """ Detached copy of a fully reduced node, or None if it isn't a value """
+    if node.type_tag == 'int':
+        return Node.fromint(node.asint())
+    if node.type_tag == 'bool':
+        return true_node if node.asbool() else false_node
+    if node.type_tag == 'str':
+        return Node('S' + node.asstr())
+    return None
+
+
+# Number of child expressions following each indicator
+arity = {'T': 0, 'F': 0, 'v': 0, 'I': 0, 'S': 0, 'U': 1, 'L': 1, 'B': 2, '?': 3}
+
+
 def parse(tokens):
     """ Parse list of tokens into tree of nodes """
     assert isinstance(tokens, list), f"Expected list, got {type(tokens)}"
-    assert len(tokens) > 0, f"Expected non-empty list, got {tokens}"
-    token = tokens.pop(0)
-    assert isinstance(token, str) and len(token), f"bad token {token}"
-    indicator = token[0]
-    if indicator in 'TFvIS':
-        return Node(token)
-    if indicator in 'UL':
-        return Node(token, [parse(tokens)])
-    if indicator in 'B':
-        return Node(token, [parse(tokens), parse(tokens)])
-    if indicator in '?':
-        return Node(token, [parse(tokens), parse(tokens), parse(tokens)])
-    raise ValueError(f"Unknown indicator {indicator}")
+    # Operators waiting for children, as [token, children, arity]
+    pending = []
+    i = 0
+    while True:
+        assert i < len(tokens), f"Expected non-empty list, got {tokens[i:]}"
+        token = tokens[i]
+        i += 1
+        assert isinstance(token, str) and len(token), f"bad token {token}"
+        indicator = token[0]
+        if indicator not in arity:
+            raise ValueError(f"Unknown indicator {indicator}")
+        if arity[indicator]:
+            pending.append([token, [], arity[indicator]])
+            continue
+        node = Node(token)
+        node.shape = shape_of(token, ())
+        # Completing a child may complete its parent in turn
+        while pending:
+            parent = pending[-1]
+            parent[1].append(node)
+            if len(parent[1]) < parent[2]:
+                break
+            pending.pop()
+            node = Node(parent[0], parent[1])
+            node.shape = shape_of(parent[0], parent[1])
+        else:
+            # Like the recursive version, leave any trailing tokens
+            del tokens[:i]
+            return node
 
 
 def step(node):
     """ Single step of evaluation, returns False done """
-    print("Stepping at node", node.token, "id", id(node))
-    # Children first
-    if node.children:
-        for child in node.children:
-            if step(child):
+    # Post-order walk with an explicit stack: children first, then the node itself
+    stack = [(node, False)]
+    while stack:
+        current, visited = stack.pop()
+        if visited:
+            if reduce(current):
                 return True
+        else:
+            stack.append((current, True))
+            if current.children:
+                stack.extend((child, False) for child in reversed(current.children))
+    return False
+
+
+# Rewrite rules for unary and binary operators, keyed by token. Each
+# returns whether it rewrote the node, like reduce itself.
+
+def str_to_int(node, child):
+    if child.indicator == 'S':
+        return node.replace(Node('I' + child.asstr()))
+    return False
+
+
+def int_to_str(node, child):
+    if child.indicator == 'I':
+        return node.replace(Node('S' + child.body))
+    return False
+
+
+def apply_lambda(node, left, right):
+    if not left.indicator == 'L':
+        return False
+    expression, = left.children
+    old_var = 'v' + left.body
+    new_var = 'v_' + str(next(fresh_vars))
+    expression.rename(old_var, new_var)
+    expression.supdate([left, node], new_var, right)
+    return node.replace(expression)
+
+
+def arithmetic(op):
+    def rule(node, left, right):
+        if not left.isint() or not right.isint():
+            return False
+        return node.replace(Node.fromint(op(left.asint(), right.asint())))
+    return rule
+
+
+def logic(op):
+    def rule(node, left, right):
+        return node.replace(true_node if op(left.asbool(), right.asbool()) else false_node)
+    return rule
+
+
+def equal(node, left, right):
+    if left.isbool() and right.isbool():
+        result = left.asbool() == right.asbool()
+    elif left.isint() and right.isint():
+        result = left.asint() == right.asint()
+    elif left.isstr() and right.isstr():
+        result = left.asstr() == right.asstr()
+    else:
+        return False
+    return node.replace(true_node if result else false_node)
+
+
+def comparison(op):
+    def rule(node, left, right):
+        if not left.isint() or not right.isint():
+            return False
+        return node.replace(true_node if op(left.asint(), right.asint()) else false_node)
+    return rule
+
+
+def concat(node, left, right):
+    if left.isstr() and right.isstr():
+        joined = Node('S')
+        joined.fragments = left.pieces() + right.pieces()
+        return node.replace(joined)
+    return False
+
+
+def slicing(take):
+    def rule(node, left, right):
+        if not left.isint() or not right.isstr():
+            return False
+        x, y = left.asint(), right.asstr()
+        return node.replace(Node('S' + (y[:x] if take else y[x:])))
+    return rule
+
+
+unary_rules = {
+    'U#': str_to_int,
+    'U$': int_to_str,
+}
+binary_rules = {
+    'B$': apply_lambda,
+    'B+': arithmetic(operator.add),
+    'B-': arithmetic(operator.sub),
+    'B*': arithmetic(operator.mul),
+    'B/': arithmetic(truncdiv),
+    'B%': arithmetic(truncmod),
+    'B&': logic(operator.and_),
+    'B|': logic(operator.or_),
+    'B=': equal,
+    'B<': comparison(operator.lt),
+    'B>': comparison(operator.gt),
+    'B.': concat,
+    'BT': slicing(take=True),
+    'BD': slicing(take=False),
+}
+
+
+def reduce(node):
+    """ Apply a rule at node itself, assuming its children are already reduced """
+    if DEBUG:
+        print("Stepping at node", node.token, "id", id(node))
     # Values not the root of a replacement pattern
     if node.indicator in 'TFISL':
         return False
@@ -302,97 +531,15 @@ def step(node):
         return False
     # Unary
     if node.indicator == 'U':
-        child, = node.children
-        # String to integer
-        if node.token == 'U#' and child.indicator == 'S':
-            return node.replace(Node('I' + child.body))
-        # Integer to string
-        if node.token == 'U$' and child.indicator == 'I':
-            return node.replace(Node('S' + child.body))
-        return False
+        rule = unary_rules.get(node.token)
+        return rule(node, node.children[0]) if rule else False
     # Binary
     if node.indicator == 'B':
-        left, right = node.children
-        # Application
-        if node.body in '$':
-            if not left.indicator == 'L':
-                return False
-            expression, = left.children
-            old_var = 'v' + left.body
-            new_var = 'v' + str(random.randint(1_000_000_000, 9_999_999_999))
-            expression.rename(old_var, new_var)
-            expression.supdate([left, node], new_var, right)
-            return node.replace(expression)
-        # Arithmetic
-        if node.body in '+-*/%':
-            if not left.isint() or not right.isint():
-                return False
-            a, b = left.asint(), right.asint() 
-            if node.token == 'B+':
-                result = a + b
-            elif node.token == 'B-':
-                result = a - b
-            elif node.token == 'B/':
-                result = truncdiv(a, b)
-            elif node.token == 'B%':
-                result = truncmod(a, b)
-            elif node.token == 'B*':
-                result = a * b
-            else:
-                raise NotImplementedError(node.token)
-            return node.replace(Node.fromint(result))
-        # Boolean
-        if node.body in '&|':
-            a, b = left.asbool(), right.asbool()
-            if node.token == 'B&':
-                result = a and b
-            elif node.token == 'B|':
-                result = a or b
-            else:
-                raise NotImplementedError(node.token)
-            return node.replace(Node('T' if result else 'F'))
-        # Comparison
-        if node.body in '<>=':
-            # Equality
-            if node.body in '=':
-                # Boolean
-                if left.isbool() and right.isbool():
-                    result = left.asbool() == right.asbool()
-                # Integer
-                elif left.isint() and right.isint():
-                    result = left.asint() == right.asint()
-                # String
-                elif left.isstr() and right.isstr():
-                    result = left.asstr() == right.asstr()
-                else:
-                    return False
-                return node.replace(Node('T' if result else 'F'))
-            # Inequality
-            elif node.body in '<>':
-                if left.isint() and right.isint():
-                    a, b = left.asint(), right.asint()
-                    if node.body == '<':
-                        result = a < b
-                    elif node.body == '>':
-                        result = a > b
-                    else:
-                        raise NotImplementedError(node.token)
-                    return node.replace(Node('T' if result else 'F'))
-                return False
+        rule = binary_rules.get(node.token)
+        if rule is None:
             raise NotImplementedError(node.token)
-        # String concatenation
-        if node.body in '.':
-            if left.isstr() and right.isstr():
-                return node.replace(Node('S' + left.body + right.body))
-            return False
-        # String slicing
-        if node.body in 'TD':
-            if left.isint() and right.isstr():
-                x = left.asint()
-                y = right.asstr()
-                result = y[:x] if node.body == 'T' else y[x:]
-                return node.replace(Node('S' + result))
-        raise NotImplementedError(node.token)
+        left, right = node.children
+        return rule(node, left, right)
     # Conditional
     if node.indicator == '?':
         condition, true_value, false_value = node.children
@@ -403,8 +550,43 @@ def step(node):
 
 
 def evaluate(node):
-    while step(node):
-        pass
+    """ Reduce until no rule applies anywhere in the tree """
+    # Same order as repeated step() calls, but after a reduction the walk
+    # resumes at the rewritten node rather than restarting from the root:
+    # nothing already passed can have changed.
+    # A closed application straight from the parser evaluates the same way
+    # every time, so its value is remembered by shape. The shape is only
+    # trusted on the first visit, before anything below has been rewritten.
+    stack = [(node, False)]
+    # Bound once, this loop runs for every node visit
+    push, pop = stack.append, stack.pop
+    while stack:
+        current, visited = pop()
+        if not visited:
+            shape = current.shape
+            if shape is not None:
+                current.shape = None
+                if current.token == 'B$' and not shape_free_vars[shape]:
+                    value = value_memo.get(shape)
+                    if value is not None:
+                        # replace() takes children by reference, so a
+                        # memoized U- is copied rather than shared
+                        current.replace(value if value.children is None else value_copy(value))
+                        continue
+                    push((current, ('memo', shape)))
+            push((current, True))
+            children = current.children
+            if children:
+                for child in reversed(children):
+                    push((child, False))
+        elif visited is True:
+            if reduce(current):
+                push((current, False))
+        else:
+            value = value_copy(current)
+            if value is not None:
+                value_memo[visited[1]] = value
+    node.flatten()
     return node
 
 
@@ -417,11 +599,15 @@ assert auth.startswith("Authorization: Bearer ")
 # convert to dict for requests
 auth = {"Authorization": auth.lstrip("Authorization: ").strip()}
 
+# Reuse one keep-alive connection instead of a new TLS handshake per post
+session = requests.Session()
+session.headers.update(auth)
+
 def post(s):
     assert isinstance(s, str), f"Expected string, got {type(s)}"
     assert not s.startswith("S"), f"Don't pre-encode"
     data = 'S' + encode(s)
-    response = requests.post(post_addr, headers=auth, data=data)
+    response = session.post(post_addr, data=data)
     response.raise_for_status()
     return response.text
 
@@ -1,25 +1,56 @@
 #!/usr/bin/env python
 #%%
+import operator
+import sys
 from collections import defaultdict
 from typing import List, Tuple, Union, Any, Optional, Dict
 from dataclasses import dataclass, field
-import math
+import numpy as np
 
 
 
 def truncdiv(a, b):
-    return math.trunc(a / b)
+    q, r = divmod(a, b)
+    return q + 1 if r and (a < 0) != (b < 0) else q
 
 
 def truncmod(a, b):
     return a - b * truncdiv(a, b)
 
 
+# Base-94 digit characters '!'..'~' to digit values 0..93
+b94_digits = bytes.maketrans(bytes(range(33, 127)), bytes(range(94)))
+
+
+# Nine base-94 digits is the most that fits a signed 64 bit block
+b94_block = 9
+b94_block_powers = 94 ** np.arange(b94_block - 1, -1, -1, dtype=np.int64)
+
+
+def c2b94_long(s):
+    # Horner inside numpy per block, then join the blocks pairwise so the
+    # bigint multiplies stay balanced
+    digits = np.frombuffer(s.encode('ascii'), dtype=np.uint8).astype(np.int64) - 33
+    pad = (-len(digits)) % b94_block
+    digits = np.concatenate([np.zeros(pad, dtype=np.int64), digits])
+    values = [int(v) for v in digits.reshape(-1, b94_block) @ b94_block_powers]
+    base = 94 ** b94_block
+    while len(values) > 1:
+        if len(values) % 2:
+            values.insert(0, 0)
+        values = [hi * base + lo for hi, lo in zip(values[::2], values[1::2])]
+        base *= base
+    return values[0]
+
+
 def c2b94(s):
+    # int(s, 94) is out of reach (int() stops at base 36), so translate to
+    # digit values in one C call and only the multiply-add stays in Python
+    if len(s) > 64:
+        return c2b94_long(s)
     value = 0
-    for c in s:
-        value *= 94
-        value += ord(c) - 33
+    for digit in s.encode('ascii').translate(b94_digits):
+        value = value * 94 + digit
     return value
 
 
@@ -27,34 +58,49 @@ def b942c(value):
     assert isinstance(value, int) and value >= 0, value
     if value == 0:
         return '!'
-    s = ""
+    digits = bytearray()
     while value:
         value, r = divmod(value, 94)
-        s = chr(r + 33) + s
-    return s
+        digits.append(r + 33)
+    digits.reverse()
+    return digits.decode('ascii')
 
 
 str_reference = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789!\"#$%&'()*+,-./:;<=>?@[\\]^_`|~ \n"
-decode_map = {chr(k): v for (k, v) in zip(list(range(33,33 + len(str_reference))),str_reference)}
-encode_map = {v: k for (k, v) in decode_map.items()}
-decode_trans = str.maketrans(decode_map)
-encode_trans = str.maketrans(encode_map)
+decode_trans = bytes.maketrans(bytes(range(33, 33 + len(str_reference))), str_reference.encode('latin1'))
+encode_trans = bytes.maketrans(str_reference.encode('latin1'), bytes(range(33, 33 + len(str_reference))))
 
 
 def decode(s):
-    assert isinstance(s, str), f"Expected string, got {type(s)}"
-    return s.translate(decode_trans)
+    return s.encode('latin1').translate(decode_trans).decode('latin1')
 
 def encode(s):
-    assert isinstance(s, str), f"Expected string, got {type(s)}"
-    return s.translate(encode_trans)
+    return s.encode('latin1').translate(encode_trans).decode('latin1')
 
 
-@dataclass
+@dataclass(slots=True)
 class Node:
     token: str
-    children: Optional[List['Node']] = None
+    # Tuples: arities are fixed, and a tuple is one compact block
+    children: Optional[Tuple['Node', ...]] = None
+    # Also reachable from somewhere else: a variable binding or another
+    # parent. Everything below a shared node is shared too.
+    shared: bool = field(default=False, compare=False, repr=False)
+    # Decoded integer of an I token, filled in on first use
+    value: Optional[int] = field(default=None, compare=False, repr=False)
+
+    @classmethod
+    def from_int(cls, value: int) -> 'Node':
+        node = cls('I' + b942c(value))
+        node.value = value
+        return node
+
+    def int_value(self) -> int:
+        if self.value is None:
+            self.value = c2b94(self.token[1:])
+        return self.value
 
+    # Hot paths read token[0] and token[1:] directly, a property costs a call
     @property
     def indicator(self) -> str:
         return self.token[0]
@@ -65,38 +111,59 @@ class Node:
     
     def leaf_eq(self, other: 'Node') -> bool:
         """ Simple test for leaf equality, false does not imply inequality """
-        if self.indicator in 'TFvIS':
+        if self is other:
+            return self.token[0] in 'TFvIS'
+        if self.token[0] in 'TFvIS':
             return self.token == other.token
         return False
     
     def walk(self):
-        yield self
-        if self.children:
-            for child in self.children:
-                yield from child.walk()
+        """ Pre-order nodes from a flat stack, not a generator per level """
+        stack = [self]
+        pop, extend = stack.pop, stack.extend
+        while stack:
+            node = pop()
+            yield node
+            if node.children:
+                extend(reversed(node.children))
     
     def dump(self):
         return ' '.join(n.token for n in self.walk())
 
     def copy(self):
-        children = [c.copy() for c in self.children] if self.children else None
-        return Node(self.token, children)
+        children = tuple(c.copy() for c in self.children) if self.children else None
+        node = Node(self.token, children)
+        node.value = self.value
+        return node
 
-    def rename(self, old, new):
-        if self.token == old:
-            self.token = new
-        elif self.indicator == 'L' and self.body == old[1:]:
-            return
-        if self.children:
-            for c in self.children:
-                c.rename(old, new)
+    def rename(self, old, new, shared=False):
+        """ Rename free occurrences of old, returning the renamed node
+
+        Shared nodes are left alone, the paths down to their occurrences
+        are copied instead.
+        """
+        if self.token[0] == 'L' and self.token[1:] == old[1:]:
+            return self
+        shared = shared or self.shared
+        token = new if self.token == old else self.token
+        children = tuple(c.rename(old, new, shared) for c in self.children) if self.children else None
+        if not shared:
+            self.token, self.children = token, children
+            return self
+        if token == self.token and all(r is c for r, c in zip(children or [], self.children or [])):
+            return self
+        # Untouched children now hang off the copy as well
+        for r, c in zip(children or [], self.children or []):
+            if r is c:
+                c.shared = True
+        return Node(token, children)
 
     def match(self, pattern: 'Node') -> Optional[Dict[str, 'Node']]:
         ''' Return dict of placeholder matches or None '''
         if pattern.token in 'xyz':  # Placeholders
             return {pattern.token: self}
         if len(pattern.token) == 1:
-            if pattern.indicator != self.indicator:
+            if pattern.token != self.token[0]:
                 return None
         elif pattern.token != self.token:
             return None
@@ -105,6 +172,10 @@ class Node:
             match = sc.match(pc)
             if match is None:
                 return None
+            if self.shared:
+                # A rewrite lifts these out from under a shared node
+                for node in match.values():
+                    node.shared = True
             matches.update(match)
         return matches
     
@@ -114,34 +185,66 @@ class Node:
             node = matches.pop(pattern.token)
             self.token = node.token
             self.children = node.children
+            self.value = node.value
+            if node.shared and node.children:
+                # The children are taken by reference, they stay where they were too
+                for child in self.children:
+                    child.shared = True
             return self
         # build in place
         self.token = pattern.token
+        self.value = None
         if pattern.children is None:
             self.children = None
             return self
         # build children
-        self.children = []
-        for pc in pattern.children:
-            self.children.append(Node(pc.token).replace(pc, matches))
+        self.children = tuple(Node(pc.token).replace(pc, matches) for pc in pattern.children)
         return self
 
 
 def parse(prog) -> Node:
     tokens = prog.strip().split() if isinstance(prog, str) else prog
-    node = Node(tokens.pop(0))
-    if node.indicator in 'TFvISxyz':
+    # Interned so token compares and rule lookups hit the identity shortcut
+    node = Node(sys.intern(tokens.pop(0)))
+    indicator = node.token[0]
+    if indicator in 'TFvISxyz':
         return node
-    if node.indicator in 'LU':
-        node.children = [parse(tokens)]
+    if indicator in 'LU':
+        node.children = (parse(tokens),)
         return node
-    if node.indicator in 'B':
-        node.children = [parse(tokens), parse(tokens)]
+    if indicator in 'B':
+        node.children = (parse(tokens), parse(tokens))
         return node
-    if node.indicator in '?':
-        node.children = [parse(tokens), parse(tokens), parse(tokens)]
+    if indicator in '?':
+        node.children = (parse(tokens), parse(tokens), parse(tokens))
         return node
-    raise ValueError(f"Unknown indicator {node.indicator}, {node.token}")
+    raise ValueError(f"Unknown indicator {indicator}, {node.token}")
+
+
+def share(root: Node) -> Node:
+    """ Make structurally equal subtrees one shared node, bottom up
+
+    A reduction of one copy is then a reduction of all of them.
+    """
+    consed = {}
+    stack = [(root, False)]
+    while stack:
+        node, done = stack.pop()
+        if not node.children:
+            continue
+        if not done:
+            stack.append((node, True))
+            stack.extend((child, False) for child in node.children)
+            continue
+        children = []
+        for child in node.children:
+            key = (child.token, *map(id, child.children or ()))
+            canonical = consed.setdefault(key, child)
+            if canonical is not child:
+                canonical.shared = True
+            children.append(canonical)
+        node.children = tuple(children)
+    return root
 
 
 assert parse("I123").match(parse("I")) == {}
@@ -222,11 +325,57 @@ B= U- x U- y -> B= x y
 ? F x y -> y
 """
 
+# Generated matchers by pattern text, shared by every ICFP instance
+matchers = {}
+
+
+def compile_pattern(pattern: Node):
+    """ Unrolled equivalent of node.match(pattern), generated once per pattern """
+    text = pattern.dump()
+    if text in matchers:
+        return matchers[text]
+    checks, flags, binds = [], [], []
+
+    def visit(p, name, ancestors):
+        if p.token in 'xyz':  # Placeholders
+            binds.append(f"{p.token!r}: {name}")
+            if ancestors:
+                # A rewrite lifts these out from under a shared node
+                shared = ' or '.join(f"{a}.shared" for a in ancestors)
+                flags.append(f"    if {shared}:\n        {name}.shared = True")
+            return
+        if len(p.token) == 1:
+            checks.append(f"    if {name}.token[0] != {p.token!r}:\n        return None")
+        else:
+            checks.append(f"    if {name}.token != {p.token!r}:\n        return None")
+        if p.children:
+            names = [f"{name}_{i}" for i in range(len(p.children))]
+            checks.append(f"    {', '.join(names)}, = {name}.children")
+            for pc, child in zip(p.children, names):
+                visit(pc, child, ancestors + [name])
+
+    visit(pattern, 'n', [])
+    source = '\n'.join(["def match(n):", *checks, *flags, f"    return {{{', '.join(binds)}}}"])
+    namespace = {}
+    exec(compile(source, f"<pattern {text}>", 'exec'), namespace)
+    matchers[text] = namespace['match']
+    return matchers[text]
+
+
 @dataclass
 class Rule:
     pattern: Node
     replace: Node
 
+    def __post_init__(self):
+        self.matcher = compile_pattern(self.pattern)
+        # One level of placeholders and bare indicators is decided by the
+        # dispatch key alone, these just bind (placeholder, child index)
+        children = self.pattern.children or []
+        self.shallow = None
+        if all(c.token in 'xyz' or len(c.token) == 1 and not c.children for c in children):
+            self.shallow = [(c.token, i) for i, c in enumerate(children) if c.token in 'xyz']
+
     @classmethod
     def from_line(cls, line: str):
         left, right = line.split('->')
@@ -234,7 +383,7 @@ class Rule:
         return cls(pattern, replace)
 
     def match(self, node: Node):
-        return node.match(self.pattern)
+        return self.matcher(node)
     
     def apply(self, node: Node, matches: Dict[str, Node]):
         node.replace(self.replace, matches)
@@ -269,9 +418,8 @@ class ArithmeticRule(Rule):
 
     def apply(self, node: Node, matches: Dict[str, Node]):
         left, right = node.children
-        a, b = c2b94(left.body), c2b94(right.body)
-        c = self.func(a, b)
-        matches['x'] = Node(f"I{b942c(c)}")
+        c = self.func(left.int_value(), right.int_value())
+        matches['x'] = Node.from_int(c)
         node.replace(self.replace, matches)
 
 
@@ -321,8 +469,7 @@ class ComparisonRule(Rule):
 
     def apply(self, node: Node, matches: Dict[str, Node]):
         left, right = node.children
-        a, b = c2b94(left.body), c2b94(right.body)
-        matches['x'] = Node("T" if self.func(a, b) else "F")
+        matches['x'] = Node("T" if self.func(left.int_value(), right.int_value()) else "F")
         node.replace(self.replace, matches)
 
 
@@ -348,6 +495,67 @@ class EqualsRule(ComparisonRule):
         return a == b
 
 
+@dataclass
+class FoldRule(Rule):
+    """ Collapse a whole subtree of integer arithmetic in one step
+
+    Folds only when every intermediate result is a non-negative integer.
+    Then the arithmetic rules would reach the same node one operator at a
+    time, and anything else is left to them. B= is not folded, the
+    generic B= x y rule gets to it first.
+
+    Values, failures included, are memoized by node for one search, so
+    a long chain that does not fold is walked once, not once per level.
+    The search clears the memo, the tree changes between searches.
+    """
+    pattern: Node = field(default_factory=lambda: parse('x'))
+    replace: Node = field(default_factory=lambda: parse('x'))
+    memo: Dict[int, Optional[int]] = field(default_factory=dict, repr=False)
+
+    arithmetic = {'B+': operator.add, 'B-': operator.sub, 'B*': operator.mul, 'B/': truncdiv, 'B%': truncmod}
+    comparisons = {'B<': operator.lt, 'B>': operator.gt}
+
+    def value(self, node: Node) -> Optional[int]:
+        if node.token[0] == 'I':
+            return node.int_value()
+        func = self.arithmetic.get(node.token)
+        if func is None:
+            return None
+        key = id(node)
+        if key in self.memo:
+            return self.memo[key]
+        c = None
+        operands = self.operands(node)
+        if operands is not None:
+            try:
+                c = func(*operands)
+            except ZeroDivisionError:
+                pass
+            if c is not None and c < 0:
+                c = None
+        self.memo[key] = c
+        return c
+
+    def operands(self, node: Node) -> Optional[Tuple[int, int]]:
+        left, right = node.children
+        a = self.value(left)
+        if a is None:
+            return None
+        b = self.value(right)
+        if b is None:
+            return None
+        return a, b
+
+    def fold(self, node: Node) -> Optional[Node]:
+        if node.token in self.comparisons:
+            operands = self.operands(node)
+            if operands is None:
+                return None
+            return Node("T" if self.comparisons[node.token](*operands) else "F")
+        value = self.value(node)
+        return None if value is None else Node.from_int(value)
+
+
 @dataclass
 class EquivalenceRule(Rule):
     pattern: Node = field(default_factory=lambda: parse('B= x y'))
@@ -379,7 +587,7 @@ class ApplicationRule(Rule):
     def apply(self, node: Node, matches: Dict[str, Node]):
         old_var = 'v' + node.children[0].body
         new_var = self.icfp.new_var(matches.pop('y'))
-        matches['x'].rename(old_var, new_var)
+        matches['x'] = matches['x'].rename(old_var, new_var)
         node.replace(self.replace, matches)
 
 
@@ -393,15 +601,38 @@ class VariableRule(Rule):
         return {} if node.token in self.icfp.variables else None
 
     def apply(self, node: Node, matches: Dict[str, Node]):
-        matches['x'] = self.icfp.variables[node.token].copy()
+        # The bound node itself, so a reduction under one use of the
+        # variable is seen by all of them
+        matches['x'] = self.icfp.variables[node.token]
         node.replace(self.replace, matches)
 
 
+# Rules that hold no per-program state, built once and shared by every ICFP
+static_rules = [Rule.from_line(line) for line in PATTERNS_TEXT.strip().split('\n')
+                if line.strip() and not line.strip().startswith('#')]
+static_rules += [
+    StrToIntRule(),
+    IntToStrRule(),
+    AdditionRule(),
+    SubtractionRule(),
+    MultiplicationRule(),
+    DivisionRule(),
+    ModulusRule(),
+    LessThanRule(),
+    GreaterThanRule(),
+    EqualsRule(),
+    EquivalenceRule(),
+    ConcatenationRule(),
+]
+
+
 @dataclass
 class Affordance:
     node: Node
     rule: Rule
     matches: Dict[str, Node]
+    # The node is shared or sits below a shared node
+    shared: bool = False
 
     def __str__(self):
         return f"Affordance({self.rule})"
@@ -412,56 +643,130 @@ class ICFP:
     root: Node
     variables: Dict[int, Node] = field(default_factory=dict)
     rules: Dict[str, List[Rule]] = field(default_factory=lambda: defaultdict(list))
+    fold_rule: FoldRule = field(default_factory=FoldRule, init=False, repr=False)
+    # Candidate rules by (token, child shapes...), see node_rules
+    dispatch: Dict[tuple, List[Rule]] = field(default_factory=dict, init=False, repr=False)
+    # Pre-order search state kept between steps: (root, pending, path)
+    cursor: Optional[tuple] = field(default=None, init=False, repr=False)
 
     def __post_init__(self):
         if isinstance(self.root, str):
-            self.root = parse(self.root)
-        for line in PATTERNS_TEXT.strip().split('\n'):
-            if line.strip() and not line.strip().startswith('#'):
-                self.add_rule(Rule.from_line(line))
-        self.add_rule(StrToIntRule())
-        self.add_rule(IntToStrRule())
-        self.add_rule(AdditionRule())
-        self.add_rule(SubtractionRule())
-        self.add_rule(MultiplicationRule())
-        self.add_rule(DivisionRule())
-        self.add_rule(ModulusRule())
-        self.add_rule(LessThanRule())
-        self.add_rule(GreaterThanRule())
-        self.add_rule(EqualsRule())
-        self.add_rule(EquivalenceRule())
-        self.add_rule(ConcatenationRule())
+            self.root = share(parse(self.root))
+        for rule in static_rules:
+            self.add_rule(rule)
         self.add_rule(ApplicationRule(icfp=self))
         self.add_rule(VariableRule(icfp=self))
 
     def add_rule(self, rule: Rule):
         self.rules[rule.pattern.token].append(rule)
+        self.dispatch.clear()
     
     def new_var(self, node: Node) -> str:
         name = f'v{len(self.variables):09d}'
+        node.shared = True
         self.variables[name] = node
         return name
 
-    def get_affordances(self):
-        affordances = [] # list of (node, rule, matches) tuple
+    def node_rules(self, node: Node) -> List[Rule]:
+        """ Rules whose pattern fits the node's token and the shape of its children
+
+        Operator children are keyed by token, leaves by indicator, so one
+        dict lookup replaces trying every rule for the token. Rules keep
+        their order. Deeper patterns and exact leaf tokens are still
+        checked by the rule's matcher.
+        """
+        # Token specific rules and indicator generic rules
+        token = node.token
+        if not node.children:
+            return self.rules[token] + self.rules[token[0]]
+        key = (token, *[c.token if c.token[0] in 'UB?' else c.token[0] for c in node.children])
+        rules = self.dispatch.get(key)
+        if rules is None:
+            rules = self.dispatch[key] = [
+                rule for rule in self.rules[token] + self.rules[token[0]]
+                if all(pc.token in 'xyz' or pc.token[0] == shape[0] and (len(pc.token) == 1 or len(shape) == 1 or pc.token == shape)
+                       for pc, shape in zip(rule.pattern.children or [], key[1:]))]
+        return rules
+
+    def node_affordances(self, node: Node):
+        if node.token in FoldRule.arithmetic or node.token in FoldRule.comparisons:
+            folded = self.fold_rule.fold(node)
+            if folded is not None:
+                yield Affordance(node, self.fold_rule, {'x': folded})
+        for rule in self.node_rules(node):
+            if rule.shallow is None:
+                matches = rule.matcher(node)
+                if matches is None:
+                    continue
+            else:
+                # The key matched, so the rule does
+                matches = {name: node.children[i] for name, i in rule.shallow}
+                if node.shared:
+                    for child in matches.values():
+                        child.shared = True
+            yield Affordance(node, rule, matches)
+
+    def iter_affordances(self):
+        self.fold_rule.memo.clear()
         for node in self.root.walk():
-            # Token specific rules and indicator generic rules
-            for rule in self.rules[node.token] + self.rules[node.indicator]:
-                matches = node.match(rule.pattern)
-                if matches is not None:
-                    affordance = Affordance(node, rule, matches)
-                    affordances.append(affordance)
-        return affordances
+            yield from self.node_affordances(node)
+
+    def get_affordances(self):
+        return list(self.iter_affordances())
     
     def apply_affordance(self, affordance: Affordance):
+        self.cursor = None  # The tree may change anywhere, search afresh
         affordance.rule.apply(affordance.node, affordance.matches)
 
+    def next_affordance(self):
+        """ First affordance in pre-order, resuming where the last step applied
+
+        A rule rewrites only the subtree of the node it applied to, and
+        nothing before that node in pre-order had an affordance. So only
+        its ancestors, whose patterns can look into it, need matching
+        again before the walk resumes at the node itself. That does not
+        hold for shared nodes, step starts over after rewriting one.
+        """
+        self.fold_rule.memo.clear()
+        if self.cursor is None or self.cursor[0] is not self.root:
+            pending, path = [(self.root, 0)], []
+        else:
+            _, pending, path = self.cursor
+            for depth, ancestor in enumerate(path):
+                affordance = next(self.node_affordances(ancestor), None)
+                if affordance is not None:
+                    affordance.shared = any(a.shared for a in path[:depth + 1])
+                    # Drop the pending nodes inside the ancestor's subtree
+                    while pending and pending[-1][1] > depth:
+                        pending.pop()
+                    pending.append((ancestor, depth))
+                    del path[depth:]
+                    return affordance
+        while pending:
+            node, depth = pending.pop()
+            del path[depth:]
+            affordance = next(self.node_affordances(node), None)
+            if affordance is not None:
+                affordance.shared = node.shared or any(a.shared for a in path)
+                # Revisit this node first next time, it is rewritten in place
+                pending.append((node, depth))
+                self.cursor = (self.root, pending, path)
+                return affordance
+            path.append(node)
+            if node.children:
+                pending.extend((child, depth + 1) for child in reversed(node.children))
+        self.cursor = None
+        return None
+
     def step(self):
-        affordances = self.get_affordances()
-        if not affordances:
+        # Only the first affordance is applied, so stop looking once found
+        affordance = self.next_affordance()
+        if affordance is None:
             return False
-        affordance = affordances[0]
-        self.apply_affordance(affordance)
+        affordance.rule.apply(affordance.node, affordance.matches)
+        if affordance.shared:
+            # The node may also sit earlier in pre-order
+            self.cursor = None
         return True
 
     def run(self):
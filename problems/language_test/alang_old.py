@@ -109,20 +109,39 @@ with open(test_path, 'r') as file:
     language_test = file.read()
 
 
+# Base-94 digit characters '!'..'~' to digit values 0..93
+b94_digits = bytes.maketrans(bytes(range(33, 127)), bytes(range(94)))
+# Digits per chunk, small enough that a chunk stays a single-digit int
+b94_chunk = 9
+b94_chunk_base = 94 ** b94_chunk
+
+
 def c2b94(s):
+    # Horner on small ints within a chunk, one big multiply per chunk
+    digits = s.encode('ascii').translate(b94_digits)
+    # The leading partial chunk goes first so every later chunk is full
+    start = len(digits) % b94_chunk
     value = 0
-    for c in s:
-        value *= 94
-        value += ord(c) - 33
+    for digit in digits[:start]:
+        value = value * 94 + digit
+    for i in range(start, len(digits), b94_chunk):
+        chunk = 0
+        for digit in digits[i:i + b94_chunk]:
+            chunk = chunk * 94 + digit
+        value = value * b94_chunk_base + chunk
     return value
 
 
 def b942c(value):
-    s = ""
+    # Nine digits per big division, each chunk split with small-int divmods
+    digits = bytearray()
     while value:
-        value, r = divmod(value, 94)
-        s = chr(r + 33) + s
-    return s
+        value, chunk = divmod(value, b94_chunk_base)
+        for _ in range(b94_chunk):
+            chunk, r = divmod(chunk, 94)
+            digits.append(r + 33)
+    digits.reverse()
+    return digits.lstrip(b'!').decode('ascii')
 
 assert c2b94("/6") == 1337
 assert b942c(1337) == "/6"
@@ -178,10 +197,8 @@ assert int(Integer('I/6')) == 1337
 
 
 str_reference = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789!\"#$%&'()*+,-./:;<=>?@[\\]^_`|~ \n"
-decode_map = {chr(k): v for (k, v) in zip(list(range(33,33 + len(str_reference))),str_reference)}
-encode_map = {v: k for (k, v) in decode_map.items()}
-decode_trans = str.maketrans(decode_map)
-encode_trans = str.maketrans(encode_map)
+decode_trans = bytes.maketrans(bytes(range(33, 33 + len(str_reference))), str_reference.encode('latin1'))
+encode_trans = bytes.maketrans(str_reference.encode('latin1'), bytes(range(33, 33 + len(str_reference))))
 
 
 @dataclass
@@ -201,11 +218,11 @@ class String(Token):
         assert self.body, f"Expected non-empty body, got {self.body}"
 
     def decode(self):
-        return self.body.translate(decode_trans)
+        return self.body.encode('latin1').translate(decode_trans).decode('latin1')
 
     @classmethod
     def encode(cls, s):
-        return "S" + s.translate(encode_trans)
+        return "S" + s.encode('latin1').translate(encode_trans).decode('latin1')
 
 
 assert String('SB%,,/}Q/2,$_').decode() == "Hello World!"
@@ -1,29 +1,59 @@
 #!/usr/bin/env python
 #%%
+import operator
+import sys
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# Check operand types on every evaluation step, slow on real programs
+DEBUG = False
 
 
-import math
 
 def truncdiv(a, b):
-    return math.trunc(a / b)
+    q, r = divmod(a, b)
+    return q + 1 if r and (a < 0) != (b < 0) else q
 
 def truncmod(a, b):
     return a - b * truncdiv(a, b)
 
+# Base-94 digit characters '!'..'~' to digit values 0..93
+b94_digits = bytes.maketrans(bytes(range(33, 127)), bytes(range(94)))
+# Digits per chunk, small enough that a chunk stays a single-digit int
+b94_chunk = 9
+b94_chunk_base = 94 ** b94_chunk
+
+
 def c2b94(s):
+    # Horner on small ints within a chunk, one big multiply per chunk
+    digits = s.encode('ascii').translate(b94_digits)
+    # The leading partial chunk goes first so every later chunk is full
+    start = len(digits) % b94_chunk
     value = 0
-    for c in s:
-        value *= 94
-        value += ord(c) - 33
+    for digit in digits[:start]:
+        value = value * 94 + digit
+    for i in range(start, len(digits), b94_chunk):
+        chunk = 0
+        for digit in digits[i:i + b94_chunk]:
+            chunk = chunk * 94 + digit
+        value = value * b94_chunk_base + chunk
     return value
 
 
 def b942c(value):
-    s = ""
+    # Nine digits per big division, each chunk split with small-int divmods
+    digits = bytearray()
     while value:
-        value, r = divmod(value, 94)
-        s = chr(r + 33) + s
-    return s
+        value, chunk = divmod(value, b94_chunk_base)
+        for _ in range(b94_chunk):
+            chunk, r = divmod(chunk, 94)
+            digits.append(r + 33)
+    digits.reverse()
+    return digits.lstrip(b'!').decode('ascii')
 
 assert c2b94("/6") == 1337
 assert b942c(1337) == "/6"
@@ -32,61 +62,80 @@ assert b942c(1337) == "/6"
 str_reference = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789!\"#$%&'()*+,-./:;<=>?@[\\]^_`|~ \n"
 decode_map = {chr(k): v for (k, v) in zip(list(range(33,33 + len(str_reference))),str_reference)}
 encode_map = {v: k for (k, v) in decode_map.items()}
-decode_trans = str.maketrans(decode_map)
-encode_trans = str.maketrans(encode_map)
+decode_trans = bytes.maketrans(''.join(decode_map).encode('latin1'), ''.join(decode_map.values()).encode('latin1'))
+encode_trans = bytes.maketrans(''.join(encode_map).encode('latin1'), ''.join(encode_map.values()).encode('latin1'))
 
 
 def decode(s):
     assert isinstance(s, str), f"Expected string, got {type(s)}"
-    return s.translate(decode_trans)
+    return s.encode('latin1').translate(decode_trans).decode('latin1')
 
 def encode(s):
     assert isinstance(s, str), f"Expected string, got {type(s)}"
-    return s.translate(encode_trans)
+    return s.encode('latin1').translate(encode_trans).decode('latin1')
 
 
 def tokenize(s):
-    assert isinstance(s, str), f"Expected string, got {type(s)}"
+    assert isinstance(s, (str, bytes)), f"Expected string, got {type(s)}"
     assert len(s) > 0, f"Expected non-empty string, got {s}"
-    return s.strip().split()
+    if isinstance(s, bytes):
+        # ICFP source is printable ASCII, latin1 maps each byte straight to a char
+        s = s.decode('latin1')
+    # Interned, repeated tokens hit the atom cache and operator tables by identity
+    return list(map(sys.intern, s.split()))
 
 
-def parse(tokens):
-    assert isinstance(tokens, list), f"Expected list, got {type(tokens)}"
-    assert len(tokens) > 0, f"Expected non-empty list, got {tokens}"
-    token, *remainder = tokens
+# Number of subexpressions following each compound indicator
+arity = {"U": 1, "L": 1, "B": 2, "?": 3}
+
+
+def check_token(token):
     indicator, body = token[0], token[1:]
     if indicator in ["T", "F"]:
         assert not body, f"Expected empty body, got {body}"
-        return token, remainder
-    if indicator == "I":
+    elif indicator == "I":
         assert body, f"Expected non-empty body, got {body}"
-        return token, remainder
-    if indicator == "S":
-        return token, remainder
-    if indicator == "U":
+    elif indicator == "S":
+        pass
+    elif indicator == "U":
         assert body in ("-", "!", "#", "$"), f"Expected -/!/#/$, got {body}"
-        value, remainder = parse(remainder)
-        return (token, value), remainder
-    if indicator == "B":
+    elif indicator == "B":
         assert body in ("+", "-", "*", "/", "%", "<", ">", "=", "|", "&", ".", "T", "D", "$"), f"Expected +,-,*,/,%,<,>,=,|,&,.,T,D,$, got {body}"
-        value1, remainder = parse(remainder)
-        value2, remainder = parse(remainder)
-        return (token, value1, value2), remainder
-    if indicator == "?":
+    elif indicator == "?":
         assert not body, f"Expected empty body, got {body}"
-        value1, remainder = parse(remainder)
-        value2, remainder = parse(remainder)
-        value3, remainder = parse(remainder)
-        return (token, value1, value2, value3), remainder
-    if indicator == "L":
+    elif indicator in ["L", "v"]:
         assert body, f"Expected non-empty body, got {body}"
-        value, remainder = parse(remainder)
-        return (token, value), remainder
-    if indicator == "v":
-        assert body, f"Expected non-empty body, got {body}"
-        return token, remainder
-    raise ValueError(f"Unknown indicator {indicator}")
+    else:
+        raise ValueError(f"Unknown indicator {indicator}")
+
+
+def parse(tokens):
+    """ Parse one expression off the front of tokens, returning it and the rest
+
+    Iterative: each compound token waits on a stack as [token, arguments]
+    until its arity is filled, so deep programs need no recursion.
+    """
+    assert isinstance(tokens, list), f"Expected list, got {type(tokens)}"
+    assert len(tokens) > 0, f"Expected non-empty list, got {tokens}"
+    pending = []
+    for i, token in enumerate(tokens):
+        check_token(token)
+        n = arity.get(token[0])
+        if n:
+            pending.append([token])
+            continue
+        value = token
+        # Close every compound expression this value completes
+        while pending:
+            frame = pending[-1]
+            frame.append(value)
+            if len(frame) <= arity[frame[0][0]]:
+                break
+            pending.pop()
+            value = tuple(frame)
+        else:
+            return value, tokens[i + 1:]
+    raise AssertionError(f"Expected more tokens, got {tokens}")
 
 
 assert parse(tokenize("T")) == ("T", [])
@@ -116,138 +165,319 @@ assert parse(tokenize("BD I$ S4%34")) == (("BD", "I$", "S4%34"), [])
 # parse(tokenize("""B$ B$ L" B$ L# B$ v" B$ v# v# L# B$ v" B$ v# v# L" L# ? B= v# I! I" B$ L$ B+ B$ v" v$ B$ v" v$ B- v# I" I%"""))
 
 
-def replace(expression, variable, replacement):
-    """ Recursively replace variable with replacement in expression """
-    assert isinstance(variable, str), f"Expected str, got {type(variable)}"
-    assert isinstance(replacement, (str, tuple, bool, int)), f"{replacement}"
-    if isinstance(expression, (str, int, bool)):
-        return replacement if expression == variable else expression
-    if isinstance(expression, tuple):
-        if len(expression) == 2 and expression[0] == "L" + variable[1:]:
-                return expression
-        return tuple(replace(e, variable, replacement) for e in expression)
-    raise ValueError(f"Unknown expression type {expression}")
+def evaluate_atom(parsed):
+    indicator, body = parsed[0], parsed[1:]
+    if indicator in ("T", "F"):
+        return True if indicator == "T" else False
+    if indicator == "I":
+        return c2b94(body)
+    if indicator == "S":
+        return decode(body)
+    if indicator == "v":
+        return parsed  # These are parsed by "B$"
+    raise ValueError(f"Unknown str indicator {indicator}")
+
+
+# Operand types and implementation of each operator, None accepts any type
+unary_ops = {
+    "-": (int, lambda value: -value),
+    "!": (bool, lambda value: not value),
+    "#": (str, lambda value: c2b94(encode(value))),
+    "$": (int, lambda value: decode(b942c(value))),
+}
+binary_ops = {
+    "+": (int, int, operator.add),
+    "-": (int, int, operator.sub),
+    "*": (int, int, operator.mul),
+    "/": (int, int, truncdiv),
+    "%": (int, int, truncmod),
+    "<": (int, int, operator.lt),
+    ">": (int, int, operator.gt),
+    "=": (None, None, operator.eq),
+    "|": (bool, bool, lambda value1, value2: value1 or value2),
+    "&": (bool, bool, lambda value1, value2: value1 and value2),
+    ".": (str, str, operator.add),
+    "T": (int, str, lambda value1, value2: value2[:value1]),
+    "D": (int, str, lambda value1, value2: value2[value1:]),
+}
+
+
+def evaluate_unary(body, value, parsed):
+    entry = unary_ops.get(body)
+    if entry is None:
+        raise ValueError(f"Unknown unary {body}, {parsed}")
+    kind, op = entry
+    if DEBUG:
+        assert isinstance(value, kind), f"Expected {kind.__name__}, got {type(value)} {value}"
+    return op(value)
+
+
+def evaluate_binary(body, value1, value2):
+    entry = binary_ops.get(body)
+    if entry is None:
+        raise ValueError(f"Unknown binary {body}")
+    kind1, kind2, op = entry
+    if DEBUG:
+        assert kind1 is None or isinstance(value1, kind1), f"Expected {kind1.__name__}, got {type(value1)} {value1}"
+        assert kind2 is None or isinstance(value2, kind2), f"Expected {kind2.__name__}, got {type(value2)} {value2}"
+    return op(value1, value2)
+
+
+def fold_numeric(node):
+    """ Fold a u/b node over integer constants into a constant node
+
+    Division by zero is left in place for evaluation to report if reached.
+    """
+    op, operands = node[1], node[2:]
+    if not all(child[0] == "const" and type(child[1]) is int for child in operands):
+        return node
+    if node[0] == "u":
+        return ("const", -operands[0][1]) if op == "-" else node
+    if op not in "+-*/%<>=" or op in "/%" and operands[1][1] == 0:
+        return node
+    return ("const", evaluate_binary(op, operands[0][1], operands[1][1]))
+
+
+# Work items on the to_debruijn() stack
+VISIT, BUILD, UNBIND = range(3)
+# Node tags of the de Bruijn form
+node_tags = {"U": "u", "B": "b", "?": "if"}
+
+
+def to_debruijn(parsed):
+    """ Rewrite a parsed program with de Bruijn indices
+
+    ("var", k) refers to the k-th enclosing lambda, innermost 0, so
+    evaluation looks arguments up in an environment instead of comparing
+    names. The other nodes are ("const", value), ("lam", body),
+    ("u", op, x), ("b", op, x, y) and ("if", c, t, e); B$ is ("b", "$", f, x).
+    """
+    atoms = {}  # token -> ("const", value), literals are decoded once
+    bound = {}  # variable number -> depths of the lambdas binding it
+    depth = 0  # number of enclosing lambdas
+    out = []
+    stack = [(VISIT, parsed)]
+    while stack:
+        kind, item = stack.pop()
+        if kind == VISIT:
+            if isinstance(item, str):
+                if item[0] == "v":
+                    depths = bound.get(c2b94(item[1:]))
+                    if depths:
+                        out.append(("var", depth - 1 - depths[-1]))
+                        continue
+                # Literals, and free variables which stand for themselves
+                node = atoms.get(item)
+                if node is None:
+                    node = atoms[item] = ("const", evaluate_atom(item))
+                out.append(node)
+                continue
+            token = item[0]
+            indicator = token[0]
+            if indicator == "L":
+                variable = c2b94(token[1:])
+                bound.setdefault(variable, []).append(depth)
+                depth += 1
+                stack.append((BUILD, ("lam", 1)))
+                stack.append((UNBIND, variable))
+                stack.append((VISIT, item[1]))
+                continue
+            if indicator not in node_tags:
+                raise ValueError(f"Unknown tuple indicator {indicator}")
+            op = (token[1:],) if token[1:] else ()
+            stack.append((BUILD, (node_tags[indicator], len(item) - 1, *op)))
+            # Children are visited first to last
+            stack.extend((VISIT, child) for child in reversed(item[1:]))
+        elif kind == BUILD:
+            n = item[1]
+            children = tuple(out[len(out) - n:])
+            del out[len(out) - n:]
+            node = (item[0], *item[2:], *children)
+            out.append(fold_numeric(node) if node[0] in ("u", "b") else node)
+        else:
+            bound[item].pop()
+            depth -= 1
+    return out[0]
+
+
+# Continuation frames on the evaluate() stack
+FORCE, UNARY, APPLY, LEFT, RIGHT, IF = range(6)
 
 
 def evaluate(parsed):
-    if isinstance(parsed, (int, bool)):
-        return parsed  # already evaluated
-    elif isinstance(parsed, str):
-        indicator, body = parsed[0], parsed[1:]
-        if indicator in ("T", "F"):
-            return True if indicator == "T" else False
-        if indicator == "I":
-            return c2b94(body)
-        if indicator == "S":
-            return decode(body)
-        if indicator == "v":
-            return parsed  # These are parsed by "B$"
-        raise ValueError(f"Unknown str indicator {indicator}")
-    elif isinstance(parsed, tuple):
-        token, *args = parsed
-        indicator, body = token[0], token[1:]
-        if indicator == "U":
-            assert len(args) == 1, f"{parsed}"
-            value = evaluate(args[0])
-            if isinstance(value, tuple):
-                return parsed # Delay evaluation
-            if body == "-":
-                assert isinstance(value, int), f"Expected int, got {type(value)} {value}"
-                return -value
-            if body == "!":
-                assert isinstance(value, bool), f"Expected bool, got {type(value)} {value}"
-                return not value
-            if body == "#":
-                assert isinstance(value, str), f"Expected str, got {type(value)} {value}"
-                return c2b94(encode(value))
-            if body == "$":
-                assert isinstance(value, int), f"Expected int, got {type(value)} {value}"
-                return decode(b942c(value))
-            raise ValueError(f"Unknown unary {body}, {parsed}")
-        if indicator == "B":
-            assert len(args) == 2, f"{parsed}"
-            value1 = evaluate(args[0])
-            value2 = evaluate(args[1])
-            if body == "+":
-                assert isinstance(value1, int), f"Expected int, got {type(value1)} {value1}"
-                assert isinstance(value2, int), f"Expected int, got {type(value2)} {value2}"
-                return value1 + value2
-            if body == "-":
-                assert isinstance(value1, int), f"Expected int, got {type(value1)} {value1}"
-                assert isinstance(value2, int), f"Expected int, got {type(value2)} {value2}"
-                return value1 - value2
-            if body == "*":
-                assert isinstance(value1, int), f"Expected int, got {type(value1)} {value1}"
-                assert isinstance(value2, int), f"Expected int, got {type(value2)} {value2}"
-                return value1 * value2
-            if body == "/":
-                assert isinstance(value1, int), f"Expected int, got {type(value1)} {value1}"
-                assert isinstance(value2, int), f"Expected int, got {type(value2)} {value2}"
-                return truncdiv(value1, value2)
-            if body == "%":
-                assert isinstance(value1, int), f"Expected int, got {type(value1)} {value1}"
-                assert isinstance(value2, int), f"Expected int, got {type(value2)} {value2}"
-                return truncmod(value1, value2)
-            if body == "<":
-                assert isinstance(value1, int), f"Expected int, got {type(value1)} {value1}"
-                assert isinstance(value2, int), f"Expected int, got {type(value2)} {value2}"
-                return value1 < value2
-            if body == ">":
-                assert isinstance(value1, int), f"Expected int, got {type(value1)} {value1}"
-                assert isinstance(value2, int), f"Expected int, got {type(value2)} {value2}"
-                return value1 > value2
-            if body == "=":
-                return value1 == value2
-            if body == "|":
-                assert isinstance(value1, bool), f"Expected bool, got {type(value1)} {value1}"
-                assert isinstance(value2, bool), f"Expected bool, got {type(value2)} {value2}"
-                return value1 or value2
-            if body == "&":
-                assert isinstance(value1, bool), f"Expected bool, got {type(value1)} {value1}"
-                assert isinstance(value2, bool), f"Expected bool, got {type(value2)} {value2}"
-                return value1 and value2
-            if body == ".":
-                assert isinstance(value1, str), f"Expected str, got {type(value1)} {value1}"
-                assert isinstance(value2, str), f"Expected str, got {type(value2)} {value2}"
-                return value1 + value2
-            if body == "T":
-                assert isinstance(value1, int), f"Expected int, got {type(value1)} {value1}"
-                assert isinstance(value2, str), f"Expected str, got {type(value2)} {value2}"
-                return value2[:value1]
-            if body == "D":
-                assert isinstance(value1, int), f"Expected int, got {type(value1)} {value1}"
-                assert isinstance(value2, str), f"Expected str, got {type(value2)} {value2}"
-                return value2[value1:]
-            if body == "$":
-                # Decide whether to evaluate first argument
-                assert isinstance(value1, tuple), f"Expected tuple, got {type(value1)} {value1}"
-                assert len(value1) == 2, f"Expected 2-tuple, got {len(value1)} {value1}"
-                name, expr = value1
-                assert isinstance(name, str), f"Expected str, got {type(name)} {name}"
-                assert name.startswith("L"), f"Expected lambda, got {value1}"
-                # Replace variable with second argument
-                variable = "v" + name[1:]
-                replaced = replace(expr, variable, value2)
-                return evaluate(replaced)
-        if indicator == "?":
-            assert len(args) == 3, f"{parsed}"
-            condition = evaluate(args[0])
-            assert isinstance(condition, bool), f"Expected bool, got {type(condition)} {condition}"
-            if condition:
-                return evaluate(args[1])
+    """ Evaluate with environments and an explicit continuation stack
+
+    Environments are linked (thunk, parent) pairs indexed by the de Bruijn
+    variables, so beta reduction never rewrites the lambda body. Arguments
+    are passed as thunks [node, env, value] that are forced on first use
+    and then keep their value (call by need). Lambdas evaluate to
+    closures (body, env).
+    """
+    node, env = to_debruijn(parsed), None
+    stack = []
+    while True:
+        # Descend until node is a value
+        tag = node[0]
+        if tag == "const":
+            value = node[1]
+        elif tag == "var":
+            for _ in range(node[1]):
+                env = env[1]
+            thunk = env[0]
+            if thunk[0] is None:
+                value = thunk[2]
             else:
-                return evaluate(args[2])
-        if indicator == "L":
-            # These are parsed by "B$"
-            assert len(args) == 1, f"{parsed}"
-            return parsed
-        raise ValueError(f"Unknown tuple indicator {indicator}")
-    else:
-        raise ValueError(f"Unknown parsed type {parsed}")
+                stack.append((FORCE, thunk))
+                node, env = thunk[0], thunk[1]
+                continue
+        elif tag == "lam":
+            value = (node[1], env)
+        elif tag == "u":
+            stack.append((UNARY, node))
+            node = node[2]
+            continue
+        elif tag == "b":
+            stack.append((APPLY if node[1] == "$" else LEFT, node, env))
+            node = node[2]
+            continue
+        elif tag == "if":
+            stack.append((IF, node, env))
+            node = node[1]
+            continue
+        else:
+            raise ValueError(f"Unknown node {tag}")
+        # Return the value to the pending frames until one needs more work
+        while stack:
+            frame = stack.pop()
+            kind = frame[0]
+            if kind == FORCE:
+                thunk = frame[1]
+                # Drop the node and environment so they can be freed
+                thunk[0] = thunk[1] = None
+                thunk[2] = value
+            elif kind == UNARY:
+                value = evaluate_unary(frame[1][1], value, frame[1])
+            elif kind == APPLY:
+                if DEBUG:
+                    assert isinstance(value, tuple), f"Expected lambda, got {type(value)} {value}"
+                body, closure = value
+                # Bind the unevaluated second argument
+                node, env = body, ([frame[1][3], frame[2], None], closure)
+                break
+            elif kind == LEFT:
+                stack.append((RIGHT, frame[1], value))
+                node, env = frame[1][3], frame[2]
+                break
+            elif kind == RIGHT:
+                value = evaluate_binary(frame[1][1], frame[2], value)
+            elif kind == IF:
+                condition = value
+                if DEBUG:
+                    assert isinstance(condition, bool), f"Expected bool, got {type(condition)} {condition}"
+                node, env = (frame[1][2] if condition else frame[1][3]), frame[2]
+                break
+        else:
+            return value
+
+
+# Tokens of the integer-only subset that eval_numeric runs without boxing
+numeric_codes = {"I": 0, "U-": 1, "B+": 2, "B-": 3, "B*": 4, "B/": 5, "B%": 6, "B<": 7, "B>": 8, "B=": 9}
+# Operands below this keep every int64 result exact
+numeric_limit = 1 << 31
+
+
+def numeric_program(tokens):
+    """ Opcode and literal arrays for eval_numeric, None outside the subset """
+    codes, literals = [], []
+    for token in tokens:
+        if token[0] == "I":
+            value = c2b94(token[1:])
+            if value >= numeric_limit:
+                return None
+            codes.append(0)
+            literals.append(value)
+        elif token in numeric_codes:
+            codes.append(numeric_codes[token])
+            literals.append(0)
+        else:
+            return None
+    if numba is not None:
+        return np.array(codes, dtype=np.int8), np.array(literals, dtype=np.int64)
+    return codes, literals
+
+
+def eval_numeric(codes, literals):
+    """ Run a prefix integer program right to left on a value stack
+
+    Returns (ok, value, is_bool). ok is False when an operand leaves the
+    exact int64 range, a comparison result meets arithmetic, a division
+    is by zero or the program is malformed, and the caller falls back.
+    """
+    n = len(codes)
+    values = [0] * n
+    bools = [False] * n
+    top = 0
+    for i in range(n - 1, -1, -1):
+        code = codes[i]
+        if code == 0:
+            values[top] = literals[i]
+            bools[top] = False
+            top += 1
+            continue
+        if code == 1:
+            if top < 1 or bools[top - 1]:
+                return False, 0, False
+            values[top - 1] = -values[top - 1]
+            continue
+        if top < 2:
+            return False, 0, False
+        # The first operand was pushed last
+        a = values[top - 1]
+        b = values[top - 2]
+        if bools[top - 1] or bools[top - 2] or abs(a) >= numeric_limit or abs(b) >= numeric_limit:
+            return False, 0, False
+        top -= 1
+        is_bool = False
+        if code == 2:
+            value = a + b
+        elif code == 3:
+            value = a - b
+        elif code == 4:
+            value = a * b
+        elif code == 5 or code == 6:
+            if b == 0:
+                return False, 0, False
+            q = abs(a) // abs(b)
+            if (a < 0) != (b < 0):
+                q = -q
+            value = q if code == 5 else a - b * q
+        else:
+            is_bool = True
+            if code == 7:
+                value = 1 if a < b else 0
+            elif code == 8:
+                value = 1 if a > b else 0
+            else:
+                value = 1 if a == b else 0
+        values[top - 1] = value
+        bools[top - 1] = is_bool
+    if top != 1:
+        return False, 0, False
+    return True, values[0], bools[0]
+
+
+if numba is not None:
+    eval_numeric = numba.njit(cache=True)(eval_numeric)
 
 
 def ept(s):
-    parsed, remainder = parse(tokenize(s))
+    tokens = tokenize(s)
+    program = numeric_program(tokens)
+    if program is not None:
+        ok, value, is_bool = eval_numeric(*program)
+        if ok:
+            return bool(value) if is_bool else int(value)
+    parsed, remainder = parse(tokens)
     assert remainder == [], f"Expected empty remainder, got {remainder}"
     return evaluate(parsed)
 
@@ -295,8 +525,8 @@ def ept(s):
 
 # %%
 if __name__ == '__main__':
-    import sys
-    s = sys.stdin.read().strip()
+    # Raw bytes skip the text layer's decoding and newline translation
+    s = sys.stdin.buffer.read()
     parsed, remainder = parse(tokenize(s))
     assert remainder == [], f"Expected empty remainder, got {remainder}"
     print(evaluate(parsed).strip())
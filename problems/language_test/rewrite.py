@@ -21,21 +21,37 @@ class Node:
         return self.token[1:]
 
 
+# Number of child expressions each indicator takes
+arity = {**dict.fromkeys('TFvISxyz', 0), 'L': 1, 'U': 1, 'B': 2, '?': 3}
+
+
 def parse(prog) -> Node:
+    """ Parse one expression; a token list is consumed like a stream """
     tokens = prog.strip().split() if isinstance(prog, str) else prog
-    node = Node(tokens.pop(0))
-    if node.indicator in 'TFvISxyz':
-        return node
-    if node.indicator in 'LU':
-        node.children = [parse(tokens)]
-        return node
-    if node.indicator in 'B':
-        node.children = [parse(tokens), parse(tokens)]
-        return node
-    if node.indicator in '?':
-        node.children = [parse(tokens), parse(tokens), parse(tokens)]
-        return node
-    raise ValueError(f"Unknown indicator {node.indicator}, {node.token}")
+    # Nodes still waiting for children, with how many they still need
+    stack = []
+    root = None
+    i = 0
+    while root is None or stack:
+        token = tokens[i]
+        i += 1
+        node = Node(token)
+        n = arity.get(node.indicator)
+        if n is None:
+            raise ValueError(f"Unknown indicator {node.indicator}, {node.token}")
+        if stack:
+            parent = stack[-1]
+            parent[0].children.append(node)
+            parent[1] -= 1
+            if not parent[1]:
+                stack.pop()
+        else:
+            root = node
+        if n:
+            stack.append([node, n])
+    if not isinstance(prog, str):
+        del tokens[:i]
+    return root
 
 
 unary_funcs = {
@@ -75,8 +91,8 @@ def escape(s):
     return f"\"{e}\""
 
 
-def unparse(node) -> str:
-    """ Unparse a node to a string in scheme """
+def unparse_node(node, args) -> str:
+    """ Scheme for a single node given the already unparsed children """
     if node.indicator == 'T':
         return '#t'
     if node.indicator == 'F':
@@ -88,23 +104,40 @@ def unparse(node) -> str:
     if node.indicator == 'v':
         return varname(node.body)
     if node.indicator in 'UL':
-        c = unparse(node.children[0])
+        c, = args
         if node.indicator == 'L':
             return f"(lambda ({varname(node.body)}) {c})"
         func = unary_funcs[node.token]
         return f"({func} {c})"
     if node.indicator in 'B':
-        left, right = node.children
-        a, b = unparse(left), unparse(right)
+        a, b = args
         func = binary_funcs[node.token]
         return f"({func} {a} {b})"
     if node.indicator == '?':
-        cond, first, second = node.children
-        c, f, s = unparse(cond), unparse(first), unparse(second)
+        c, f, s = args
         return f"(if {c} {f} {s})"
     raise NotImplementedError(f"Missing {node.token[:9]}")
 
 
+def unparse(node) -> str:
+    """ Unparse a node to a string in scheme """
+    # Post-order walk with an explicit stack; shared subtrees are unparsed once
+    done = {}
+    stack = [node]
+    while stack:
+        top = stack[-1]
+        if id(top) in done:
+            stack.pop()
+            continue
+        pending = [c for c in top.children if id(c) not in done]
+        if pending:
+            stack.extend(pending)
+            continue
+        stack.pop()
+        done[id(top)] = unparse_node(top, [done[id(c)] for c in top.children])
+    return done[id(node)]
+
+
 def main(s):
     node = parse(s)
     scm = unparse(node)
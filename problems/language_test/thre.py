@@ -103,23 +103,27 @@ The above set of language constructs are all that researchers have discovered, a
 
 
 from typing import Tuple, List, Optional, Dict
-from dataclasses import dataclass, field
-import random
+import itertools
 
-import math
 
 def truncdiv(a, b):
-    return math.trunc(a / b)
+    q, r = divmod(a, b)
+    return q + 1 if r and (a < 0) != (b < 0) else q
 
 def truncmod(a, b):
     return a - b * truncdiv(a, b)
 
 
+# Base-94 digit characters '!'..'~' to digit values 0..93
+b94_digits = bytes.maketrans(bytes(range(33, 127)), bytes(range(94)))
+# Every pair of base-94 digits, so b942c peels off two per divmod
+b94_pairs = [bytes((hi, lo)) for hi in range(33, 127) for lo in range(33, 127)]
+
+
 def c2b94(s):
     value = 0
-    for c in s:
-        value *= 94
-        value += ord(c) - 33
+    for digit in s.encode('ascii').translate(b94_digits):
+        value = value * 94 + digit
     return value
 
 
@@ -127,32 +131,33 @@ def b942c(value):
     assert isinstance(value, int) and value >= 0, value
     if value == 0:
         return '!'
-    s = ""
+    pairs = []
     while value:
-        value, r = divmod(value, 94)
-        s = chr(r + 33) + s
-    return s
+        value, r = divmod(value, 94 * 94)
+        pairs.append(b94_pairs[r])
+    pairs.reverse()
+    return b''.join(pairs).lstrip(b'!').decode('ascii')
 
 
-@dataclass
 class Node:
-    token: str
-    children: Optional[List['Node']] = None
-    substitutions: Optional[Dict[str, 'Node']] = None
-    parent: Optional['Node'] = None
-
-    def __post_init__(self):
-        if self.children:
-            for child in self.children:
+    __slots__ = ('token', 'indicator', 'body', 'children', 'substitutions', 'parent')
+
+    def __init__(self, token: str, children: Optional[List['Node']] = None,
+                 substitutions: Optional[Dict[str, 'Node']] = None, parent: Optional['Node'] = None):
+        self.children = children
+        self.substitutions = substitutions
+        self.parent = parent
+        self.set_token(token)
+        if children:
+            for child in children:
                 child.parent = self
 
-    @property
-    def indicator(self):
-        return self.token[0]
-    
-    @property
-    def body(self):
-        return self.token[1:]
+    def set_token(self, token):
+        # indicator and body are read on every step, so keep them as
+        # plain attributes rather than slicing the token each time
+        self.token = token
+        self.indicator = token[0]
+        self.body = token[1:]
     
     def asint(self):
         if self.indicator == 'I':
@@ -163,6 +168,8 @@ class Node:
     
     @classmethod
     def fromint(cls, value):
+        if 0 <= value < len(small_ints):
+            return small_ints[value]
         if value >= 0:
             return cls('I' + b942c(value))
         return cls('U-', [cls('I' + b942c(-value))])
@@ -200,21 +207,28 @@ class Node:
         assert isinstance(a, str) and a.startswith('v') and len(a) > 1, a
         assert isinstance(b, str) and b.startswith('v') and len(b) > 1, b
         assert a != b, f"{a} == {b}"
-        if self.indicator == 'v' and self.token == a:
-            self.token = b
-        if self.indicator == 'L' and self.body == a[1:]:
-            return  # Stop renaming at next lambda boundary which matches
-        if self.children:
-            for child in self.children:
-                child.rename(a, b)
-        if self.substitutions:
-            for value in self.substitutions.values():
-                value.rename(a, b)
+        # Substitution values are shared between many environments, so
+        # visit each node once rather than once per path leading to it
+        seen = set()
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            if id(node) in seen:
+                continue
+            seen.add(id(node))
+            if node.indicator == 'v' and node.token == a:
+                node.set_token(b)
+            if node.indicator == 'L' and node.body == a[1:]:
+                continue  # Stop renaming at next lambda boundary which matches
+            if node.children:
+                stack.extend(node.children)
+            if node.substitutions:
+                stack.extend(node.substitutions.values())
 
     def replace(self, node):
         self.substitutions = node.substitutions
         self.children = node.children
-        self.token = node.token
+        self.set_token(node.token)
         return True  # returned for convenience with step logic
     
     def squeeze(self, rep, nodes):
@@ -223,22 +237,58 @@ class Node:
         return self.replace(rep)
 
 
+# Suffixes for renamed bound variables, the underscore keeps them apart
+# from short names in the source program
+fresh_vars = itertools.count(1)
+
+# Shared result leaves. replace() copies their token into the target and
+# their children and substitutions are None, so nothing of theirs ends up
+# in the tree. Nodes with children can't be shared this way: replace()
+# hands the children over by reference, and steps like the B= on two U-
+# nodes then update those children in place.
+true_node = Node('T')
+false_node = Node('F')
+
+
+# Non-negative results of arithmetic near zero, shared like true_node and
+# false_node above. Negative results are U- nodes, built fresh each time.
+small_ints = [Node('I' + b942c(i)) for i in range(4096)]
+
+
+# Number of child expressions following each indicator
+arity = {'T': 0, 'F': 0, 'v': 0, 'I': 0, 'S': 0, 'U': 1, 'L': 1, 'B': 2, '?': 3}
+
+
 def parse(tokens):
     """ Parse list of tokens into tree of nodes """
     assert isinstance(tokens, list), f"Expected list, got {type(tokens)}"
-    assert len(tokens) > 0, f"Expected non-empty list, got {tokens}"
-    token = tokens.pop(0)
-    assert isinstance(token, str) and len(token), f"bad token {token}"
-    indicator = token[0]
-    if indicator in 'TFvIS':
-        return Node(token)
-    if indicator in 'UL':
-        return Node(token, [parse(tokens)])
-    if indicator in 'B':
-        return Node(token, [parse(tokens), parse(tokens)])
-    if indicator in '?':
-        return Node(token, [parse(tokens), parse(tokens), parse(tokens)])
-    raise ValueError(f"Unknown indicator {indicator}")
+    # Operators waiting for children, as [token, children, arity]
+    pending = []
+    i = 0
+    while True:
+        assert i < len(tokens), f"Expected non-empty list, got {tokens[i:]}"
+        token = tokens[i]
+        i += 1
+        assert isinstance(token, str) and len(token), f"bad token {token}"
+        indicator = token[0]
+        if indicator not in arity:
+            raise ValueError(f"Unknown indicator {indicator}")
+        if arity[indicator]:
+            pending.append([token, [], arity[indicator]])
+            continue
+        node = Node(token)
+        # Completing a child may complete its parent in turn
+        while pending:
+            parent = pending[-1]
+            parent[1].append(node)
+            if len(parent[1]) < parent[2]:
+                break
+            pending.pop()
+            node = Node(parent[0], parent[1])
+        else:
+            # Like the recursive version, leave any trailing tokens
+            del tokens[:i]
+            return node
 
 
 def step(node):
@@ -250,7 +300,7 @@ def step(node):
     if node.indicator in 'v':
         value = node.lookup(node.token)
         if value is not None:
-            node.token = value.token
+            node.set_token(value.token)
             node.children = value.children
             node.substitutions = value.substitutions
             return True
@@ -267,7 +317,7 @@ def step(node):
                 inner = child.children[0]
                 node.supdate([inner, child])
                 node.children = inner.children
-                node.token = inner
+                node.set_token(inner.token)
                 return True
             return False
         # Not
@@ -276,7 +326,7 @@ def step(node):
                 result = 'F' if child.token == 'T' else 'T'
                 node.substitutions = None
                 node.children = None
-                node.token = result
+                node.set_token(result)
                 return True
             return False
         raise ValueError(f"{node.token}")
@@ -290,11 +340,11 @@ def step(node):
             expression = lambda_.children[0]
             replacement = node.children[1]
             old_var = 'v' + lambda_.body
-            new_var = 'v' + str(random.randint(1_000_000_000, 9_999_999_999))
+            new_var = 'v_' + str(next(fresh_vars))
             expression.rename(old_var, new_var)
             node.supdate([lambda_, expression], new_var, replacement)
             node.children = expression.children
-            node.token = expression.token
+            node.set_token(expression.token)
             return True
         # Arithmetic
         if node.body in '+-*/%':
@@ -329,7 +379,7 @@ def step(node):
             right = node.children[1]
             if node.body == '&':
                 if left.token == 'F' or right.token == 'F':
-                    result = Node('F')
+                    result = false_node
                 elif left.token == 'T':
                     result = right
                 elif right.token == 'T':
@@ -338,7 +388,7 @@ def step(node):
                     return False
             elif node.body == '|':
                 if left.token == 'T' or right.token == 'T':
-                    result = Node('T')
+                    result = true_node
                 elif left.token == 'F':
                     result = right
                 elif right.token == 'F':
@@ -349,7 +399,7 @@ def step(node):
                 raise ValueError(f"{node.token}")
             node.supdate([result])
             node.children = result.children
-            node.token = result.token
+            node.set_token(result.token)
             return True
         # Comparison
         if node.body in '<>=':
@@ -399,7 +449,7 @@ def step(node):
                 raise ValueError(f"{node.token}")
             node.substitutions = None
             node.children = None
-            node.token = 'T' if result else 'F'
+            node.set_token('T' if result else 'F')
             return True
         # String concatenation
         if node.body in '.':
@@ -414,7 +464,7 @@ def step(node):
             result = left.body + right.body
             node.substitutions = None
             node.children = None
-            node.token = 'S' + result
+            node.set_token('S' + result)
             return True
         # String slicing
         if node.body in 'TD':
@@ -431,7 +481,7 @@ def step(node):
             result = y[:x] if node.body == 'T' else y[x:]
             node.substitutions = None
             node.children = None
-            node.token = 'S' + result
+            node.set_token('S' + result)
             return True
         raise NotImplementedError(node.token)
     # Conditional
@@ -446,7 +496,7 @@ def step(node):
             value = node.children[2]
         node.supdate([value])
         node.children = value.children
-        node.token = value.token
+        node.set_token(value.token)
         return True
     raise NotImplementedError(f"step {node.token}")
 
@@ -469,19 +519,15 @@ for i in range(1000):
 
 
 str_reference = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789!\"#$%&'()*+,-./:;<=>?@[\\]^_`|~ \n"
-decode_map = {chr(k): v for (k, v) in zip(list(range(33,33 + len(str_reference))),str_reference)}
-encode_map = {v: k for (k, v) in decode_map.items()}
-decode_trans = str.maketrans(decode_map)
-encode_trans = str.maketrans(encode_map)
+decode_trans = bytes.maketrans(bytes(range(33, 33 + len(str_reference))), str_reference.encode('latin1'))
+encode_trans = bytes.maketrans(str_reference.encode('latin1'), bytes(range(33, 33 + len(str_reference))))
 
 
 def decode(s):
-    assert isinstance(s, str), f"Expected string, got {type(s)}"
-    return s.translate(decode_trans)
+    return s.encode('latin1').translate(decode_trans).decode('latin1')
 
 def encode(s):
-    assert isinstance(s, str), f"Expected string, got {type(s)}"
-    return s.translate(encode_trans)
+    return s.encode('latin1').translate(encode_trans).decode('latin1')
 
 if tree.indicator == 'S':
     print(decode(tree.body))
@@ -27,20 +27,24 @@ curl -X POST
 # stolen from lambdaman6
 RLE = 'B$ B$ L" B$ L" B$ L# B$ v" B$ v# v# L# B$ v" B$ v# v# L$ L# ? B= v# I" v" B. v" B$ v$ B- v# I" Sl I#,'
 
+# Base-94 digit characters '!'..'~' to digit values 0..93
+b94_digits = bytes.maketrans(bytes(range(33, 127)), bytes(range(94)))
+
+
 def toint(s):
     value = 0
-    for c in s:
-        value *= 94
-        value += ord(c) - 33
+    for digit in s.encode('ascii').translate(b94_digits):
+        value = value * 94 + digit
     return value
 
 
 def fromint(value):
-    s = ''
+    digits = bytearray()
     while value:
-        s = chr(value % 94 + 33) + s
-        value //= 94
-    return s
+        value, r = divmod(value, 94)
+        digits.append(r + 33)
+    digits.reverse()
+    return digits.decode('ascii')
 
 
 filename = 'solution23.txt'
@@ -22,9 +22,14 @@ encode_map = {v: k for (k, v) in decode_map.items()}
 encode_trans = str.maketrans(encode_map)
 
 
+# One keep-alive connection for every level
+session = requests.Session()
+session.headers.update(auth)
+
+
 def request(s):
     data = 'S' + s.translate(encode_trans)
-    response = requests.post(post_addr, headers=auth, data=data)
+    response = session.post(post_addr, data=data)
     response.raise_for_status()
     return response.text
 
@@ -33,4 +38,4 @@ for i in range(1, 26):
     print(f"level{i}")
     with open(f"level{i}.icfp", 'w') as f:
         f.write(request(f"get spaceship{i}"))
-    time.sleep(5)
\ No newline at end of file
+    time.sleep(5)
@@ -13,6 +13,10 @@ assert auth.startswith("Authorization: Bearer ")
 # convert to dict for requests
 auth = {"Authorization": auth.lstrip("Authorization: ").strip()}
 
+# Reuse one keep-alive connection instead of a new TLS handshake per post
+session = requests.Session()
+session.headers.update(auth)
+
 str_reference = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789!\"#$%&'()*+,-./:;<=>?@[\\]^_`|~ \n"
 decode_map = {chr(k): v for (k, v) in zip(list(range(33,33 + len(str_reference))),str_reference)}
 encode_map = {v: k for (k, v) in decode_map.items()}
@@ -24,7 +28,7 @@ def request(s):
     data = 'S' + s.translate(encode_trans)
     with open("/tmp/data", "a") as f:
         f.write(data + "\n")
-    response = requests.post(post_addr, headers=auth, data=data)
+    response = session.post(post_addr, data=data)
     response.raise_for_status()
     return response.text
 